@@ -0,0 +1,102 @@
+import threading
+import chess
+from engine import normalize_fen, top_moves_key
+
+# Analisi continua in background: ogni nuova posizione viene analizzata con approfondimento iterativo
+# su un processo Stockfish dedicato, così le linee migliori sono sempre disponibili senza attendere la ricerca
+class AnalysisWorker(threading.Thread):
+    def __init__(self, stockfish, cache, max_depth=15, min_depth=6, depth_step=3, multipv=5):
+        super().__init__(daemon=True)
+        self.stockfish = stockfish
+        self.cache = cache
+        self.depths = list(range(min_depth, max_depth, depth_step)) + [max_depth]
+        self.max_depth = max_depth
+        self.multipv = multipv
+        self.running = True
+        self._fen = None
+        self._generation = 0
+        self._result = None #(fen, profondità, mosse) dell'ultima iterazione completata
+        self._searched_fen = None #ultima posizione inviata a Stockfish
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    # Nuova posizione: la ricerca in corso viene interrotta con "stop" alla prossima riga di output del motore e l'analisi ricomincia
+    def set_position(self, fen):
+        cached = self.cache.get(top_moves_key(fen, self.max_depth, self.multipv))
+        with self._lock:
+            self._fen = fen
+            self._generation += 1
+            self._result = (fen, self.max_depth, cached) if cached is not None else None
+        self._wakeup.set()
+
+    # Ultimo risultato disponibile per la posizione richiesta: (profondità, mosse) oppure None
+    def latest(self, fen):
+        with self._lock:
+            if self._result is None or normalize_fen(self._result[0]) != normalize_fen(fen):
+                return None
+            return self._result[1], self._result[2]
+
+    def _is_current(self, generation):
+        with self._lock:
+            return self.running and generation == self._generation
+
+    def run(self):
+        while self.running:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            with self._lock:
+                fen, generation, result = self._fen, self._generation, self._result
+            if fen is None or (result is not None and result[1] == self.max_depth):
+                continue
+            # ucinewgame (che svuota la tabella delle trasposizioni) solo quando la posizione cambia,
+            # non a ogni passo dell'approfondimento sulla stessa posizione
+            self.stockfish.set_fen_position(fen, send_ucinewgame_token=fen != self._searched_fen)
+            self._searched_fen = fen
+            for depth in self.depths:
+                if not self._is_current(generation):
+                    break
+                moves = self._search(fen, depth, generation)
+                if moves is None:
+                    break
+                with self._lock:
+                    if generation != self._generation:
+                        break
+                    self._result = (fen, depth, moves)
+                if depth == self.max_depth:
+                    self.cache.put(top_moves_key(fen, depth, self.multipv), moves)
+
+    # "go depth" con MultiPV letto riga per riga: se nel frattempo arriva una nuova posizione la ricerca viene fermata
+    # con "stop" e si attende il bestmove, così il processo resta sincronizzato. Restituisce le mosse come
+    # get_top_moves (valutazioni dal punto di vista del bianco) oppure None se la ricerca è stata interrotta
+    def _search(self, fen, depth, generation):
+        stockfish = self.stockfish
+        stockfish._set_option("MultiPV", self.multipv, False)
+        stockfish._put(f"go depth {depth}")
+        lines = {}
+        stopped = False
+        while True:
+            parts = stockfish._read_line().split()
+            if not stopped and not self._is_current(generation):
+                stockfish._put("stop")
+                stopped = True
+            if not parts:
+                continue
+            if parts[0] == "bestmove":
+                break
+            if parts[0] == "info" and "multipv" in parts and "score" in parts and "pv" in parts and parts[parts.index("depth") + 1] == str(depth):
+                lines[int(parts[parts.index("multipv") + 1])] = parts
+        stockfish._set_option("MultiPV", stockfish._parameters["MultiPV"])
+        if stopped:
+            return None
+        sign = 1 if chess.Board(fen).turn == chess.WHITE else -1
+        moves = []
+        for number in sorted(lines):
+            parts = lines[number]
+            score_index = parts.index("score")
+            score_type, value = parts[score_index + 1], int(parts[score_index + 2]) * sign
+            moves.append({"Move": parts[parts.index("pv") + 1], "Centipawn": value if score_type == "cp" else None, "Mate": value if score_type == "mate" else None})
+        return moves
+
+    def stop(self):
+        self.running = False
+        self._wakeup.set()
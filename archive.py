@@ -0,0 +1,142 @@
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+
+ARCHIVE_DIR = "archive"
+INDEX_FILE = "index.jsonl"
+ARCHIVE_MAX_BYTES = 500 * 1024 * 1024
+ARCHIVE_MAX_AGE_DAYS = 7
+SAMPLE_INTERVAL = 2.0 #secondi minimi tra due frame campionati (i frame forzati vengono sempre salvati)
+
+def folder_size(path):
+    total = 0
+    for folder, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(folder, name))
+    return total
+
+# Archivio della sessione: frame compressi (JPEG o WebP) e un indice JSONL con detection e informazioni di ogni frame.
+# Compressione e scrittura avvengono in un thread separato con una coda limitata: se il disco è lento
+# i frame in eccesso vengono scartati, submit non blocca mai il ciclo di riconoscimento.
+# Ogni avvio crea una sessione in archive/<data-ora>/, le sessioni più vecchie vengono eliminate
+# quando superano l'età massima o quando l'archivio supera la dimensione massima
+class FrameArchive(threading.Thread):
+    def __init__(self, folder=ARCHIVE_DIR, max_bytes=ARCHIVE_MAX_BYTES, max_age_days=ARCHIVE_MAX_AGE_DAYS, sample_interval=SAMPLE_INTERVAL, image_format="jpg", quality=80, queue_size=16):
+        super().__init__(daemon=True)
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.sample_interval = sample_interval
+        self.image_format = image_format
+        params = cv2.IMWRITE_WEBP_QUALITY if image_format == "webp" else cv2.IMWRITE_JPEG_QUALITY
+        self.encode_params = [params, quality]
+        self.session = os.path.join(folder, time.strftime("%Y%m%d-%H%M%S"))
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.running = True
+        self._last_sample = 0.0
+        self._seq = 0
+        self._session_files = deque() #(percorso, dimensione) dei frame della sessione corrente, dal più vecchio
+        self._size = 0
+
+    # Accoda un frame con le sue detection (array Nx6) e informazioni aggiuntive (es. FEN, tag della richiesta).
+    # Senza force il frame viene salvato solo se è passato sample_interval dall'ultimo campione
+    def submit(self, frame, detections=None, info=None, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_sample < self.sample_interval:
+            return False
+        self._last_sample = now
+        self._seq += 1
+        try:
+            self.queue.put_nowait((self._seq, time.time(), frame, detections, info))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def run(self):
+        os.makedirs(self.session, exist_ok=True)
+        self.apply_retention()
+        with open(os.path.join(self.session, INDEX_FILE), "a", encoding="utf-8") as index:
+            while self.running or not self.queue.empty():
+                try:
+                    item = self.queue.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                self.write(index, *item)
+
+    def write(self, index, seq, timestamp, frame, detections, info):
+        ok, encoded = cv2.imencode(f".{self.image_format}", frame, self.encode_params)
+        if not ok:
+            self.dropped += 1
+            return
+        name = f"{seq:06d}.{self.image_format}"
+        path = os.path.join(self.session, name)
+        with open(path, "wb") as file:
+            file.write(encoded.tobytes())
+        record = {"seq": seq, "time": round(timestamp, 3), "file": name, "shape": list(frame.shape[:2])}
+        if detections is not None:
+            record["detections"] = np.round(detections, 5).tolist()
+        if info:
+            record.update(info)
+        index.write(json.dumps(record) + "\n")
+        index.flush()
+        self.written += 1
+        self._session_files.append((path, len(encoded)))
+        self._size += len(encoded)
+        if self._size > self.max_bytes:
+            self.apply_retention()
+
+    # Elimina le sessioni troppo vecchie e, se l'archivio è ancora troppo grande, le sessioni più vecchie
+    # e infine i frame più vecchi della sessione corrente (le righe dell'indice senza immagine vengono saltate nel replay)
+    def apply_retention(self):
+        sessions = sorted(name for name in os.listdir(self.folder) if os.path.isdir(os.path.join(self.folder, name)))
+        sessions = [os.path.join(self.folder, name) for name in sessions if os.path.join(self.folder, name) != self.session]
+        now = time.time()
+        for session in list(sessions):
+            if now - os.path.getmtime(session) > self.max_age:
+                shutil.rmtree(session, ignore_errors=True)
+                sessions.remove(session)
+        sizes = {session: folder_size(session) for session in sessions}
+        current = sum(size for _, size in self._session_files)
+        total = sum(sizes.values()) + current
+        limit = self.max_bytes * 0.9 #margine per non ripetere la pulizia ad ogni frame
+        for session in sessions:
+            if total <= limit:
+                break
+            shutil.rmtree(session, ignore_errors=True)
+            total -= sizes[session]
+        while total > limit and self._session_files:
+            path, size = self._session_files.popleft()
+            if os.path.exists(path):
+                os.remove(path)
+            total -= size
+        self._size = total
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped, "queued": self.queue.qsize()}
+
+    def stop(self):
+        self.running = False
+
+def is_archive_session(path):
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+# Rilegge una sessione dell'archivio: (record dell'indice, frame decodificato) in ordine di acquisizione
+def read_archive(session):
+    with open(os.path.join(session, INDEX_FILE), encoding="utf-8") as index:
+        for line in index:
+            record = json.loads(line)
+            path = os.path.join(session, record["file"])
+            if not os.path.exists(path):
+                continue #frame eliminato dalla politica di conservazione
+            frame = cv2.imread(path)
+            if frame is not None:
+                yield record, frame
@@ -0,0 +1,186 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import chess
+import cv2
+import numpy as np
+from PIL import Image
+from board_renderer import BoardRenderer
+from board_state import BoardState
+from find_FEN import PIECE_MAP, dict_to_fen
+from fusion import SquareFusion
+from game_tracker import GameTracker, count_moved_pieces
+from recognize_position import (calcola_omografia, create_position_dictionary, detections_to_FEN, detections_to_state, find_corners, find_pieces_position,
+                                find_pieces_position_from_detections, load_labels, order_corners, orient_chessboard)
+
+BASELINE_FILE = "benchmark_baseline.json"
+FRAME_SIZE = (640, 480)
+PIECE_COUNTS = [4, 16, 32]
+TOLERANCE = 0.25 #rallentamento (o memoria in più) ammesso rispetto alla baseline
+SEED = 1234
+
+# Posizione sintetica con le 4 torri negli angoli (necessarie per l'orientamento) e gli altri pezzi a caso
+def synthetic_board(piece_count, rng):
+    board = chess.Board(None)
+    for square, symbol in ((chess.A1, "R"), (chess.H1, "R"), (chess.A8, "r"), (chess.H8, "r")):
+        board.set_piece_at(square, chess.Piece.from_symbol(symbol))
+    free_squares = [square for square in chess.SQUARES if board.piece_at(square) is None]
+    symbols = list("KkQqBBbbNNnnPPPPPPPPpppppppp")
+    for square, symbol in zip(rng.sample(free_squares, piece_count - 4), symbols):
+        board.set_piece_at(square, chess.Piece.from_symbol(symbol))
+    return board
+
+# Detection sintetiche (array Nx6) di una scacchiera ruotata di 45° nel frame, come vista dalla webcam:
+# ogni bounding box è posizionata in modo che il punto di appoggio cada al centro della sua casella
+def synthetic_detections(board, frame_size=FRAME_SIZE):
+    width, height = frame_size
+    # angoli a8, h8, h1, a1 della scacchiera nel frame (a8 a sinistra, h8 in alto, h1 a destra, a1 in basso)
+    corners = np.array([[0.2 * width, 0.5 * height], [0.5 * width, 0.1 * height], [0.8 * width, 0.5 * height], [0.5 * width, 0.9 * height]], dtype=np.float32)
+    rectified = np.array([[0.5, 0.5], [7.5, 0.5], [7.5, 7.5], [0.5, 7.5]], dtype=np.float32)
+    H = cv2.getPerspectiveTransform(rectified, corners)
+    symbol_to_class = {symbol: class_id for class_id, symbol in PIECE_MAP.items() if symbol is not None}
+    cells, classes = [], []
+    for square, piece in board.piece_map().items():
+        cells.append((chess.square_file(square) + 0.5, 7 - chess.square_rank(square) + 0.5))
+        classes.append(symbol_to_class[piece.symbol()])
+    points = cv2.perspectiveTransform(np.array(cells, dtype=np.float32).reshape(-1, 1, 2), H).reshape(-1, 2)
+    box_w, box_h = 0.04, 0.08
+    detections = np.zeros((len(points), 6), dtype=np.float32)
+    detections[:, 0] = classes
+    detections[:, 1] = points[:, 0] / width
+    detections[:, 2] = points[:, 1] / height - 0.3 * box_h #il punto di appoggio è il 20% sopra il fondo della box
+    detections[:, 3] = box_w
+    detections[:, 4] = box_h
+    detections[:, 5] = 0.9
+    return detections
+
+# Immagine e file di etichette YOLO sintetici per le funzioni che leggono dal disco
+def write_sample(folder, name, detections, frame_size=FRAME_SIZE):
+    image_path = os.path.join(folder, f"{name}.png")
+    labels_path = os.path.join(folder, f"{name}.txt")
+    Image.new("RGB", frame_size).save(image_path)
+    np.savetxt(labels_path, detections, fmt=["%d", "%.6f", "%.6f", "%.6f", "%.6f", "%.4f"])
+    return image_path, labels_path
+
+# Tempo per chiamata (mediana e minimo su repeat misure, in microsecondi) e picco di memoria allocata da una chiamata
+def measure(function, repeat=7, min_time=0.05):
+    function()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        if time.perf_counter() - start >= min_time:
+            break
+        number *= 2
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        samples.append((time.perf_counter() - start) / number * 1e6)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    function()
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return {"median_us": round(statistics.median(samples), 2), "min_us": round(min(samples), 2), "peak_bytes": peak}
+
+def benchmark_cases(folder, piece_counts=PIECE_COUNTS):
+    rng = random.Random(SEED)
+    cases = {}
+    for piece_count in piece_counts:
+        board = synthetic_board(piece_count, rng)
+        detections = synthetic_detections(board)
+        frame_shape = (FRAME_SIZE[1], FRAME_SIZE[0])
+        image_path, labels_path = write_sample(folder, f"pieces{piece_count}", detections)
+        corners = order_corners(find_corners(image_path, labels_path))
+        geometry = orient_chessboard(image_path, labels_path)
+        positions = find_pieces_position(image_path, labels_path, geometry)
+        position_dict = create_position_dictionary(positions)
+        # la posizione successiva differisce per una mossa legale (se disponibile), come tra due cicli di riconoscimento
+        next_board = board.copy()
+        legal_moves = list(next_board.legal_moves)
+        if legal_moves:
+            next_board.push(legal_moves[0])
+        fen, next_fen = board.fen(), next_board.fen()
+        suffix = f"[{piece_count}]"
+        cases["load_labels" + suffix] = lambda path=labels_path: load_labels(path)
+        cases["find_corners" + suffix] = lambda i=image_path, l=labels_path: find_corners(i, l)
+        cases["orient_chessboard" + suffix] = lambda i=image_path, l=labels_path: orient_chessboard(i, l)
+        cases["calcola_omografia" + suffix] = lambda i=image_path, c=corners: calcola_omografia(i, c, (800, 800))
+        cases["find_pieces_position" + suffix] = lambda i=image_path, l=labels_path, g=geometry: find_pieces_position(i, l, g)
+        cases["find_pieces_position_from_detections" + suffix] = lambda d=detections, g=geometry: find_pieces_position_from_detections(d, frame_shape, g)
+        cases["create_position_dictionary" + suffix] = lambda p=positions: create_position_dictionary(p)
+        cases["dict_to_fen" + suffix] = lambda p=position_dict: dict_to_fen(p)
+        cases["detections_to_FEN" + suffix] = lambda d=detections, g=geometry: detections_to_FEN(g, d, frame_shape)
+        cases["count_moved_pieces" + suffix] = lambda a=fen, b=next_fen: count_moved_pieces(a, b)
+        state, next_state = BoardState.from_board(board), BoardState.from_board(next_board)
+        cases["detections_to_state" + suffix] = lambda d=detections, g=geometry: detections_to_state(g, d, frame_shape)
+        cases["board_state_fen" + suffix] = lambda s=state: s.fen("w", "KQkq", "-", 0, 1)
+        cases["board_state_diff" + suffix] = lambda a=state, b=next_state: a.changed_squares(b)
+        cases["board_state_to_base_board" + suffix] = lambda s=state: s.to_base_board()
+        fusion = SquareFusion(board.board_fen())
+        cases["fusion_observe" + suffix] = lambda f=fusion, d=detections, g=geometry: f.observe_detections(g, d, frame_shape)
+        cases["tracker_update" + suffix] = lambda b=board, n=next_board: GameTracker(b.copy()).update(n.board_fen())
+    renderer = BoardRenderer(600, cache_size=0) #senza cache: misura il disegno delle caselle cambiate
+    boards = [chess.Board(), chess.Board()]
+    boards[1].push_san("e4")
+    state = {"index": 0}
+    def render_move():
+        state["index"] ^= 1
+        board = boards[state["index"]]
+        renderer.render(board, board.peek() if board.move_stack else None, (), 35)
+    cases["update_board_render"] = render_move
+    return cases
+
+def run(filter_text=None):
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for name, function in benchmark_cases(folder).items():
+            if filter_text and filter_text not in name:
+                continue
+            results[name] = measure(function)
+            print(f"{name:<45} {results[name]['median_us']:>10.2f} us  (min {results[name]['min_us']:.2f})  {results[name]['peak_bytes']:>9} B", file=sys.stderr)
+    return results
+
+# Confronto con la baseline: restituisce l'elenco dei benchmark più lenti o che allocano più memoria oltre la tolleranza
+def compare(results, baseline, tolerance=TOLERANCE):
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if result["median_us"] > reference["median_us"] * (1 + tolerance):
+            regressions.append(f"{name}: {reference['median_us']} us -> {result['median_us']} us")
+        if result["peak_bytes"] > reference["peak_bytes"] * (1 + tolerance) + 1024:
+            regressions.append(f"{name}: {reference['peak_bytes']} B -> {result['peak_bytes']} B")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark delle funzioni di riconoscimento, FEN e disegno della scacchiera (offline, senza webcam né modello)")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="file JSON con i risultati di riferimento")
+    parser.add_argument("--save-baseline", action="store_true", help="salva i risultati come nuova baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--filter", help="esegue solo i benchmark il cui nome contiene questo testo")
+    args = parser.parse_args()
+    results = run(args.filter)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline salvata in {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSIONE {regression}")
+        sys.exit(1 if regressions else 0)
+    else:
+        print(f"Nessuna baseline in {args.baseline}: crearla con python benchmark.py --save-baseline")
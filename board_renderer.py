@@ -0,0 +1,137 @@
+import os
+from collections import OrderedDict
+import chess
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SPRITES_DIR = os.path.join(BASE_DIR, "sprites") #pezzi di chess.svg già rasterizzati (rigenerabili con build_sprites.py)
+SPRITE_SIZE = 128 #lato dei pezzi in sprites/, ridimensionati alla dimensione delle caselle al caricamento
+PIECE_SYMBOLS = "PNBRQKpnbrqk"
+# Colori di chess.svg
+LIGHT_SQUARE = (255, 206, 158)
+DARK_SQUARE = (209, 139, 71)
+LASTMOVE_LIGHT = (205, 209, 106)
+LASTMOVE_DARK = (170, 162, 59)
+MARGIN_COLOR = (33, 33, 33)
+COORD_COLOR = (229, 229, 229)
+UNCERTAIN_COLOR = (255, 0, 0)
+UNCERTAIN_ALPHA = 0x55 / 255 #stessa trasparenza del riempimento "#ff000055"
+EVAL_BAR_WIDTH = 20
+EVAL_RANGE_CP = 800 #vantaggio in centipedoni oltre il quale la barra della valutazione è piena
+
+# Lato delle caselle con le stesse proporzioni tra caselle e bordo di chess.svg
+def square_size_for(size):
+    return round(size * 360 / 390) // 8
+
+def sprite_path(symbol, sprites_dir=SPRITES_DIR):
+    color = "w" if symbol.isupper() else "b"
+    return os.path.join(sprites_dir, f"{color}{symbol.lower()}.png")
+
+# Carica i pezzi pre-rasterizzati del repository alla dimensione delle caselle: a runtime non serve cairo
+def load_sprites(square_size, sprites_dir=SPRITES_DIR):
+    sprites = {}
+    for symbol in PIECE_SYMBOLS:
+        sprite = Image.open(sprite_path(symbol, sprites_dir)).convert("RGBA")
+        if sprite.size != (square_size, square_size):
+            sprite = sprite.resize((square_size, square_size), Image.LANCZOS)
+        sprites[symbol] = np.asarray(sprite, dtype=np.float32) / 255.0
+    return sprites
+
+# Disegna la scacchiera incollando caselle già pronte (colore, evidenziazione, pezzo) in un'unica immagine:
+# ad ogni aggiornamento vengono ridisegnate solo le caselle cambiate e i frame vengono tenuti in cache per posizione
+class BoardRenderer:
+    def __init__(self, size=600, eval_bar=EVAL_BAR_WIDTH, cache_size=256, sprites_dir=SPRITES_DIR):
+        self.square_size = square_size_for(size)
+        self.margin = (size - 8 * self.square_size) // 2
+        self.size = size
+        self.eval_bar = eval_bar
+        self.sprites = load_sprites(self.square_size, sprites_dir)
+        self.tiles = {}
+        self.frame = self.draw_background()
+        self.frame_state = [None] * 64
+        self.frame_bar = None
+        self.frames = OrderedDict()
+        self.cache_size = cache_size
+
+    # Bordo con le coordinate, disegnato una sola volta
+    def draw_background(self):
+        image = Image.new("RGB", (self.size + self.eval_bar, self.size), MARGIN_COLOR)
+        draw = ImageDraw.Draw(image)
+        font = ImageFont.load_default(size=max(8, self.margin * 2 // 3))
+        for index in range(8):
+            center = self.margin + index * self.square_size + self.square_size // 2
+            for y in (self.margin // 2, self.size - self.margin // 2):
+                draw.text((center, y), chess.FILE_NAMES[index], fill=COORD_COLOR, font=font, anchor="mm")
+            for x in (self.margin // 2, self.size - self.margin // 2):
+                draw.text((x, center), chess.RANK_NAMES[7 - index], fill=COORD_COLOR, font=font, anchor="mm")
+        return image
+
+    # Casella pronta per colore, evidenziazione ("lastmove", "uncertain" o None) e pezzo, calcolata al primo utilizzo
+    def tile(self, light, highlight, symbol):
+        key = (light, highlight, symbol)
+        tile = self.tiles.get(key)
+        if tile is None:
+            if highlight == "lastmove":
+                color = np.array(LASTMOVE_LIGHT if light else LASTMOVE_DARK, dtype=np.float32) / 255.0
+            else:
+                color = np.array(LIGHT_SQUARE if light else DARK_SQUARE, dtype=np.float32) / 255.0
+            if highlight == "uncertain":
+                color = color * (1 - UNCERTAIN_ALPHA) + np.array(UNCERTAIN_COLOR, dtype=np.float32) / 255.0 * UNCERTAIN_ALPHA
+            rgb = np.broadcast_to(color, (self.square_size, self.square_size, 3))
+            if symbol is not None:
+                sprite = self.sprites[symbol]
+                alpha = sprite[:, :, 3:]
+                rgb = rgb * (1 - alpha) + sprite[:, :, :3] * alpha
+            tile = Image.fromarray(np.round(rgb * 255).astype(np.uint8))
+            self.tiles[key] = tile
+        return tile
+
+    def square_origin(self, square):
+        x = self.margin + chess.square_file(square) * self.square_size
+        y = self.margin + (7 - chess.square_rank(square)) * self.square_size
+        return x, y
+
+    # Altezza in pixel della parte bianca della barra (valutazione in centipedoni dal punto di vista del bianco)
+    def bar_height(self, evaluation):
+        if evaluation is None:
+            return None
+        ratio = 0.5 + max(-EVAL_RANGE_CP, min(EVAL_RANGE_CP, evaluation)) / (2 * EVAL_RANGE_CP)
+        return round(ratio * (self.size - 2 * self.margin))
+
+    def draw_bar(self, white_height):
+        if not self.eval_bar or white_height == self.frame_bar:
+            return
+        x0, x1 = self.size + 2, self.size + self.eval_bar - 2
+        top, bottom = self.margin, self.size - self.margin
+        if white_height is None:
+            self.frame.paste(MARGIN_COLOR, (x0, top, x1, bottom))
+        else:
+            self.frame.paste((64, 64, 64), (x0, top, x1, bottom - white_height))
+            self.frame.paste((240, 240, 240), (x0, bottom - white_height, x1, bottom))
+        self.frame_bar = white_height
+
+    # uncertain: caselle (indici di python-chess) da evidenziare, evaluation: centipedoni dal punto di vista del bianco
+    def render(self, board, lastmove=None, uncertain=(), evaluation=None):
+        white_height = self.bar_height(evaluation)
+        key = (board.board_fen(), lastmove.uci() if lastmove else None, frozenset(uncertain), white_height)
+        image = self.frames.get(key)
+        if image is not None:
+            self.frames.move_to_end(key)
+            return image
+        highlighted = {lastmove.from_square, lastmove.to_square} if lastmove else set()
+        for square in chess.SQUARES:
+            piece = board.piece_at(square)
+            highlight = "uncertain" if square in uncertain else "lastmove" if square in highlighted else None
+            state = (piece.symbol() if piece else None, highlight)
+            if state != self.frame_state[square]:
+                x, y = self.square_origin(square)
+                light = (chess.square_file(square) + chess.square_rank(square)) % 2 == 1
+                self.frame.paste(self.tile(light, highlight, state[0]), (x, y))
+                self.frame_state[square] = state
+        self.draw_bar(white_height)
+        image = self.frame.copy()
+        self.frames[key] = image
+        while len(self.frames) > self.cache_size:
+            self.frames.popitem(last=False)
+        return image
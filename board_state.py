@@ -0,0 +1,122 @@
+import chess
+import numpy as np
+from find_FEN import PIECE_MAP
+
+EMPTY = 12
+PIECE_CLASSES = [(chess.PAWN, chess.WHITE), (chess.ROOK, chess.WHITE), (chess.KNIGHT, chess.WHITE), (chess.BISHOP, chess.WHITE), (chess.QUEEN, chess.WHITE), (chess.KING, chess.WHITE),
+                 (chess.PAWN, chess.BLACK), (chess.ROOK, chess.BLACK), (chess.KNIGHT, chess.BLACK), (chess.BISHOP, chess.BLACK), (chess.QUEEN, chess.BLACK), (chess.KING, chess.BLACK)] #(tipo, colore) di ogni classe del modello
+# Tabelle di traduzione byte -> carattere della FEN ('1' = casella vuota) e carattere -> classe
+CLASS_TO_CHAR = bytes((ord(PIECE_MAP[value]) if value != EMPTY else ord("1")) for value in range(13)) + bytes(243)
+CHAR_TO_CLASS = bytes.maketrans(b"PRNBQKprnbqk1", bytes(range(13)))
+EXPAND_DIGITS = [(str(count), "1" * count) for count in range(2, 9)]
+# Nomi delle caselle indicizzati per [riga, colonna] della vista rettificata (riga 0 = traversa 8)
+SQUARE_NAMES = np.array([[f"{file}{rank}" for file in "abcdefgh"] for rank in "87654321"])
+CHESS_SQUARES = np.array([[chess.square(col, 7 - row) for col in range(8)] for row in range(8)]) #indice di python-chess di ogni [riga, colonna]
+
+# Posizione come matrice 8x8 di uint8 con le classi del modello (riga 0 = traversa 8, colonna 0 = colonna a, 12 = vuota).
+# Prodotta direttamente dalla mappatura delle detection, senza dizionari né stringhe per casella:
+# confronti, FEN e conversioni verso python-chess sono operazioni vettoriali sulla matrice
+class BoardState:
+    __slots__ = ("squares",)
+
+    def __init__(self, squares=None):
+        self.squares = np.full((8, 8), EMPTY, dtype=np.uint8) if squares is None else np.asarray(squares, dtype=np.uint8)
+
+    # Caselle (righe, colonne) e classi delle detection: a parità di casella vince la detection più sicura
+    @classmethod
+    def from_cells(cls, rows, cols, classes, confs=None):
+        state = cls()
+        if confs is not None:
+            order = np.argsort(confs, kind="stable")
+            rows, cols, classes = rows[order], cols[order], classes[order]
+        state.squares[rows, cols] = classes
+        return state
+
+    @classmethod
+    def from_board_fen(cls, board_fen):
+        expanded = board_fen.split(" ")[0].replace("/", "")
+        for digit, empty in EXPAND_DIGITS:
+            expanded = expanded.replace(digit, empty)
+        return cls(np.frombuffer(expanded.encode().translate(CHAR_TO_CLASS), dtype=np.uint8).reshape(8, 8).copy())
+
+    @classmethod
+    def from_board(cls, board):
+        masks = np.array([board.pieces_mask(piece_type, color) for piece_type, color in PIECE_CLASSES], dtype="<u8")
+        bits = np.unpackbits(masks.view(np.uint8).reshape(12, 8), axis=1, bitorder="little")
+        by_square = np.full(64, EMPTY, dtype=np.uint8)
+        for value in range(12):
+            by_square[bits[value].astype(bool)] = value
+        return cls(by_square[CHESS_SQUARES])
+
+    def copy(self):
+        return BoardState(self.squares.copy())
+
+    def __eq__(self, other):
+        return isinstance(other, BoardState) and np.array_equal(self.squares, other.squares)
+
+    def __repr__(self):
+        return f"BoardState('{self.board_fen()}')"
+
+    # Parte della FEN relativa ai pezzi: traduzione dei byte in caratteri e compressione delle caselle vuote consecutive
+    def board_fen(self):
+        chars = self.squares.tobytes().translate(CLASS_TO_CHAR).decode()
+        fen = "/".join(chars[index:index + 8] for index in range(0, 64, 8))
+        for count in range(8, 1, -1):
+            fen = fen.replace("1" * count, str(count))
+        return fen
+
+    # FEN completa: turn "w"/"b" (o chess.WHITE/chess.BLACK), castling es. "KQkq" o "-", en_passant es. "e3" o "-"
+    def fen(self, turn="w", castling="-", en_passant="-", halfmove_clock=0, fullmove_number=1):
+        if isinstance(turn, bool):
+            turn = "w" if turn == chess.WHITE else "b"
+        return f"{self.board_fen()} {turn} {castling or '-'} {en_passant or '-'} {halfmove_clock} {fullmove_number}"
+
+    # 12 bitboard (una per classe, bit = indice di casella di python-chess)
+    def bitboards(self):
+        by_square = np.empty(64, dtype=np.uint8)
+        by_square[CHESS_SQUARES.ravel()] = self.squares.ravel()
+        one_hot = by_square[None, :] == np.arange(12, dtype=np.uint8)[:, None]
+        return np.packbits(one_hot, axis=1, bitorder="little").view("<u8").ravel().tolist()
+
+    # chess.BaseBoard costruita direttamente dalle bitboard, senza passare dalla FEN
+    def to_base_board(self):
+        return self._fill(chess.BaseBoard.empty())
+
+    # chess.Board con i pezzi impostati dalle bitboard come to_base_board; turno, arrocchi e presa en passant
+    # accettano gli stessi valori di fen() e non passa dalla FEN dei pezzi
+    def to_board(self, turn=chess.WHITE, castling="-", en_passant="-", halfmove_clock=0, fullmove_number=1):
+        board = self._fill(chess.Board.empty())
+        board.turn = turn if isinstance(turn, bool) else turn == "w"
+        board.set_castling_fen(castling or "-")
+        board.ep_square = None if en_passant in (None, "-") else chess.parse_square(en_passant)
+        board.halfmove_clock = halfmove_clock
+        board.fullmove_number = fullmove_number
+        return board
+
+    # Copia le bitboard dei pezzi in una BaseBoard o Board vuota
+    def _fill(self, board):
+        masks = self.bitboards()
+        board.pawns, board.rooks, board.knights, board.bishops, board.queens, board.kings = (masks[value] | masks[value + 6] for value in range(6))
+        board.occupied_co[chess.WHITE] = masks[0] | masks[1] | masks[2] | masks[3] | masks[4] | masks[5]
+        board.occupied_co[chess.BLACK] = masks[6] | masks[7] | masks[8] | masks[9] | masks[10] | masks[11]
+        board.occupied = board.occupied_co[chess.WHITE] | board.occupied_co[chess.BLACK]
+        return board
+
+    # Matrice 8x8 di bool delle caselle diverse tra le due posizioni
+    def changed_mask(self, other):
+        return self.squares != other.squares
+
+    # Caselle diverse in notazione scacchistica (es. ["e2", "e4"])
+    def changed_squares(self, other):
+        return SQUARE_NAMES[self.changed_mask(other)].tolist()
+
+    # Caselle diverse come indici di python-chess
+    def diff(self, other):
+        return CHESS_SQUARES[self.changed_mask(other)].tolist()
+
+    # Numero di pezzi di questa posizione che non si trovano più sulla stessa casella nell'altra
+    def moved_pieces(self, other):
+        return int(np.count_nonzero((self.squares != EMPTY) & (self.squares != other.squares)))
+
+    def piece_count(self):
+        return int(np.count_nonzero(self.squares != EMPTY))
@@ -0,0 +1,22 @@
+import argparse
+import os
+import chess
+import chess.svg
+from board_renderer import PIECE_SYMBOLS, SPRITE_SIZE, SPRITES_DIR, sprite_path
+
+# Rasterizza i pezzi di chess.svg nella cartella sprites/ del repository. Serve solo per rigenerare i file
+# (es. con una dimensione diversa): l'applicazione carica i PNG già pronti e non richiede cairosvg
+def build_sprites(size=SPRITE_SIZE, sprites_dir=SPRITES_DIR):
+    import cairosvg
+    os.makedirs(sprites_dir, exist_ok=True)
+    for symbol in PIECE_SYMBOLS:
+        svg_data = chess.svg.piece(chess.Piece.from_symbol(symbol), size=size)
+        cairosvg.svg2png(bytestring=svg_data.encode("utf-8"), write_to=sprite_path(symbol, sprites_dir))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rasterizza i pezzi di chess.svg in PNG (richiede pip install cairosvg)")
+    parser.add_argument("--size", type=int, default=SPRITE_SIZE, help="lato in pixel dei pezzi")
+    parser.add_argument("--output", default=SPRITES_DIR)
+    args = parser.parse_args()
+    build_sprites(args.size, args.output)
+    print(f"Pezzi salvati in {args.output}")
@@ -0,0 +1,145 @@
+import os
+import numpy as np
+import yaml
+from ultralytics import YOLO
+from ultralytics.utils.checks import check_requirements
+
+DETECTION_MODEL = "chesspiece-detection-model.pt"
+DETECTION_BACKEND = "pytorch" #pytorch, onnx, onnx-int8, openvino, openvino-int8 (modelli creati con export_detector.py)
+DETECTION_CONF = 0.25
+ROI_IMGSZ = 416 #lato dell'immagine (letterbox) con cui viene elaborata la sola regione della scacchiera, variabile DETECTION_IMGSZ
+
+# Percorso del modello esportato per il backend scelto, a partire dai pesi PyTorch
+def backend_weights(weights_path, backend):
+    base, _ = os.path.splitext(weights_path)
+    if backend == "onnx":
+        return base + ".onnx"
+    if backend == "onnx-int8":
+        return base + "-int8.onnx"
+    if backend == "openvino":
+        return base + "_openvino_model"
+    if backend == "openvino-int8":
+        return base + "_int8_openvino_model"
+    if backend != "pytorch":
+        raise ValueError(f"Backend del detector sconosciuto: {backend}")
+    return weights_path
+
+# Dimensione d'ingresso fissa di un modello esportato senza --dynamic (None se accetta qualsiasi dimensione e batch):
+# per ONNX si legge la forma dell'ingresso del grafo, per OpenVINO il metadata.yaml scritto da ultralytics
+def fixed_input_size(weights_path):
+    if weights_path.endswith(".onnx"):
+        check_requirements("onnxruntime") #installato da ultralytics al primo utilizzo, come per l'inferenza
+        import onnxruntime
+        shape = onnxruntime.InferenceSession(weights_path, providers=["CPUExecutionProvider"]).get_inputs()[0].shape
+        if any(isinstance(dim, str) for dim in shape):
+            return None
+        height, width = shape[2:4]
+    elif os.path.isdir(weights_path):
+        with open(os.path.join(weights_path, "metadata.yaml"), encoding="utf-8") as file:
+            metadata = yaml.safe_load(file)
+        if (metadata.get("args") or {}).get("dynamic"):
+            return None
+        height, width = metadata["imgsz"]
+    else:
+        return None
+    return int(height) if height == width else [int(height), int(width)]
+
+# Detector dei pezzi residente: i pesi vengono caricati una sola volta e il modello
+# viene condiviso da overlay live, riconoscimento periodico e riorientamento.
+# Senza weights_path il modello è scelto dalle variabili DETECTION_MODEL e DETECTION_BACKEND
+class ChessPieceDetector:
+    def __init__(self, weights_path=None, conf=DETECTION_CONF, warmup=True, roi_imgsz=None):
+        self.weights_path = weights_path or backend_weights(os.getenv("DETECTION_MODEL", DETECTION_MODEL), os.getenv("DETECTION_BACKEND", DETECTION_BACKEND))
+        self.conf = conf
+        self.roi_imgsz = roi_imgsz or int(os.getenv("DETECTION_IMGSZ", ROI_IMGSZ))
+        self.model = YOLO(self.weights_path, task="detect")
+        # un modello statico accetta solo la dimensione e il batch 1 dell'esportazione: ogni predizione usa quella
+        self.fixed_imgsz = fixed_input_size(self.weights_path)
+        if self.fixed_imgsz is not None and self.fixed_imgsz != self.roi_imgsz:
+            print(f"Il modello {self.weights_path} è esportato a {self.fixed_imgsz} pixel senza --dynamic: la regione della scacchiera viene elaborata a {self.fixed_imgsz} invece che a {self.roi_imgsz}")
+            self.roi_imgsz = self.fixed_imgsz
+        if warmup:
+            self.warmup()
+
+    # Prima inferenza a vuoto: inizializza pesi, backend e buffer prima del primo frame reale
+    def warmup(self, image_size=(480, 640)):
+        dummy_frame = np.zeros((image_size[0], image_size[1], 3), dtype=np.uint8)
+        self.predict(dummy_frame)
+
+    # Unica API di predizione, restituisce il risultato relativo alla singola immagine
+    def predict(self, source, **kwargs):
+        kwargs.setdefault("conf", self.conf)
+        kwargs.setdefault("verbose", False)
+        if self.fixed_imgsz is not None:
+            kwargs["imgsz"] = self.fixed_imgsz
+        results = self.model.predict(source=source, **kwargs)
+        return results[0]
+
+    # Predizione su più immagini (es. una per scacchiera) con un'unica chiamata al modello, un risultato per immagine.
+    # Un modello esportato con batch 1 elabora le immagini una alla volta
+    def predict_batch(self, sources, **kwargs):
+        if self.fixed_imgsz is not None:
+            return [self.predict(source, **kwargs) for source in sources]
+        kwargs.setdefault("conf", self.conf)
+        kwargs.setdefault("verbose", False)
+        return self.model.predict(source=list(sources), **kwargs)
+
+    # Predizione che restituisce direttamente l'array Nx6 delle detection
+    def detect(self, source, **kwargs):
+        return detections_from_result(self.predict(source, **kwargs))
+
+    # Predizione limitata alla regione della scacchiera (x0, y0, x1, y1): il ritaglio viene ridimensionato con letterbox
+    # a roi_imgsz e le detection vengono riportate alle coordinate normalizzate del frame intero.
+    # Restituisce (risultato di YOLO relativo al ritaglio, detection nel frame); senza roi elabora tutto il frame
+    def predict_roi(self, frame, roi, **kwargs):
+        if roi is None:
+            result = self.predict(frame, **kwargs)
+            return result, detections_from_result(result)
+        kwargs.setdefault("imgsz", self.roi_imgsz)
+        result = self.predict(crop_roi(frame, roi), **kwargs)
+        return result, detections_to_frame(detections_from_result(result), roi, frame.shape)
+
+    def detect_roi(self, frame, roi, **kwargs):
+        return self.predict_roi(frame, roi, **kwargs)[1]
+
+    # Versione a batch di detect_roi (una regione per frame, None = frame intero): i ritagli vengono elaborati
+    # insieme a roi_imgsz, i frame interi in una seconda chiamata alla risoluzione di default
+    def detect_batch_roi(self, frames, rois, **kwargs):
+        detections = [None] * len(frames)
+        cropped = [index for index, roi in enumerate(rois) if roi is not None]
+        full = [index for index, roi in enumerate(rois) if roi is None]
+        if cropped:
+            results = self.predict_batch([crop_roi(frames[index], rois[index]) for index in cropped], **{"imgsz": self.roi_imgsz, **kwargs})
+            for index, result in zip(cropped, results):
+                detections[index] = detections_to_frame(detections_from_result(result), rois[index], frames[index].shape)
+        if full:
+            results = self.predict_batch([frames[index] for index in full], **kwargs)
+            for index, result in zip(full, results):
+                detections[index] = detections_from_result(result)
+        return detections
+
+# Converte il risultato di YOLO in un array Nx6 con colonne: classe, x, y, w, h (normalizzate), confidenza
+def detections_from_result(result):
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return np.zeros((0, 6), dtype=np.float32)
+    cls = boxes.cls.cpu().numpy().reshape(-1, 1)
+    xywhn = boxes.xywhn.cpu().numpy()
+    conf = boxes.conf.cpu().numpy().reshape(-1, 1)
+    return np.hstack((cls, xywhn, conf)).astype(np.float32)
+
+def crop_roi(frame, roi):
+    x0, y0, x1, y1 = roi
+    return frame[y0:y1, x0:x1]
+
+# Riporta le detection normalizzate rispetto al ritaglio roi alle coordinate normalizzate del frame intero
+def detections_to_frame(detections, roi, frame_shape):
+    x0, y0, x1, y1 = roi
+    frame_height, frame_width = frame_shape[:2]
+    scale_x = (x1 - x0) / frame_width
+    scale_y = (y1 - y0) / frame_height
+    detections[:, 1] = detections[:, 1] * scale_x + x0 / frame_width
+    detections[:, 2] = detections[:, 2] * scale_y + y0 / frame_height
+    detections[:, 3] *= scale_x
+    detections[:, 4] *= scale_y
+    return detections
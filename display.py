@@ -0,0 +1,60 @@
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+from find_FEN import PIECE_MAP
+
+# Colori (BGR) delle bounding box: pezzi bianchi, pezzi neri, caselle vuote
+WHITE_BOX = (255, 200, 0)
+BLACK_BOX = (0, 80, 255)
+EMPTY_BOX = (160, 160, 160)
+ROI_BOX = (0, 255, 0)
+
+def box_color(class_id):
+    if class_id < 6:
+        return WHITE_BOX
+    if class_id < 12:
+        return BLACK_BOX
+    return EMPTY_BOX
+
+# Visualizzazione del video senza allocazioni per frame: i buffer (BGR ridimensionato e RGBA) e la PhotoImage
+# vengono creati una sola volta, ogni frame viene ridimensionato e convertito dentro gli stessi buffer
+# e la PhotoImage viene aggiornata con paste
+class FrameDisplay:
+    def __init__(self, label, size=(768, 576), interpolation=cv2.INTER_LINEAR):
+        self.label = label
+        self.width, self.height = size
+        self.interpolation = interpolation
+        self.resized = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.rgba = np.empty((self.height, self.width, 4), dtype=np.uint8)
+        # l'immagine PIL condivide la memoria di self.rgba (PIL condivide i buffer solo a 4 canali), quindi non va ricreata ad ogni frame
+        self.image = Image.frombuffer("RGBA", size, self.rgba, "raw", "RGBA", 0, 1)
+        self.photo = None
+
+    # detections: array Nx6 (classe, x, y, w, h normalizzate, confidenza) relative al frame
+    def draw_boxes(self, detections):
+        for class_id, x, y, w, h, conf in detections:
+            color = box_color(int(class_id))
+            x1, y1 = int((x - w / 2) * self.width), int((y - h / 2) * self.height)
+            x2, y2 = int((x + w / 2) * self.width), int((y + h / 2) * self.height)
+            cv2.rectangle(self.resized, (x1, y1), (x2, y2), color, 2)
+            cv2.putText(self.resized, f"{PIECE_MAP[int(class_id)] or '-'} {conf:.2f}", (x1, max(12, y1 - 4)), cv2.FONT_HERSHEY_SIMPLEX, 0.45, color, 1, cv2.LINE_AA)
+
+    # Regione della scacchiera elaborata dal detector, (x0, y0, x1, y1) in pixel del frame
+    def draw_roi(self, roi, frame_shape):
+        scale_x = self.width / frame_shape[1]
+        scale_y = self.height / frame_shape[0]
+        x0, y0, x1, y1 = roi
+        cv2.rectangle(self.resized, (int(x0 * scale_x), int(y0 * scale_y)), (int(x1 * scale_x) - 1, int(y1 * scale_y) - 1), ROI_BOX, 1)
+
+    def show(self, frame, detections=None, roi=None):
+        cv2.resize(frame, (self.width, self.height), dst=self.resized, interpolation=self.interpolation)
+        if roi is not None:
+            self.draw_roi(roi, frame.shape)
+        if detections is not None and len(detections):
+            self.draw_boxes(detections)
+        cv2.cvtColor(self.resized, cv2.COLOR_BGR2RGBA, dst=self.rgba)
+        if self.photo is None:
+            self.photo = ImageTk.PhotoImage(image=self.image)
+            self.label.configure(image=self.photo)
+        else:
+            self.photo.paste(self.image)
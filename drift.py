@@ -0,0 +1,98 @@
+import cv2
+import numpy as np
+from recognize_position import BoardGeometry
+
+DRIFT_INTERVAL = 10 #frame tra due controlli della deriva
+DRIFT_VIEW_SIZE = 320 #lato della vista rettificata usata per il confronto
+DRIFT_MARGIN = 1.0 #caselle attorno alla scacchiera incluse nella vista (bordo e tavolo danno punti stabili)
+MIN_INLIERS = 20 #corrispondenze coerenti minime per accettare una correzione
+MIN_SHIFT = 0.05 #caselle: spostamenti più piccoli vengono ignorati (rumore)
+MAX_SHIFT = 1.5 #caselle: oltre questo spostamento il tracking non è affidabile e serve il riorientamento
+LOST_CHECKS = 3 #controlli consecutivi falliti dopo cui la scacchiera è considerata persa
+
+TRACKING = "tracking"
+CORRECTED = "corretta"
+LOST = "persa"
+
+# Inseguimento della deriva della telecamera (o della scacchiera urtata) senza rilevare di nuovo le torri:
+# all'orientamento viene salvata una vista rettificata di riferimento con i suoi punti ORB; ogni pochi frame
+# il frame corrente viene rettificato con l'omografia attuale e confrontato con il riferimento.
+# La trasformazione residua stimata con RANSAC corregge l'omografia in modo incrementale
+class DriftTracker:
+    def __init__(self, geometry, frame, size=DRIFT_VIEW_SIZE, margin=DRIFT_MARGIN, interval=DRIFT_INTERVAL, features=600):
+        self.geometry = geometry
+        self.size = size
+        self.interval = interval
+        self.square = size / (8 + 2 * margin) #lato di una casella nella vista, in pixel
+        w, h = geometry.output_size
+        # dalla vista rettificata della geometria (output_size) alla vista del tracker, con il margine attorno
+        scale = self.square / geometry.square_size
+        self.S = np.array([[scale, 0, margin * self.square], [0, scale, margin * self.square], [0, 0, 1]], dtype=np.float64)
+        self.board_corners = cv2.perspectiveTransform(np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]], dtype=np.float32).reshape(-1, 1, 2), self.S).reshape(-1, 2)
+        self.orb = cv2.ORB_create(nfeatures=features)
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+        self.frames = 0
+        self.failures = 0
+        self.status = TRACKING
+        self.shift = 0.0 #ultimo spostamento misurato, in caselle
+        self.corrections = 0
+        self.set_reference(frame)
+
+    def rectify(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        return cv2.warpPerspective(gray, self.S @ self.geometry.H, (self.size, self.size), flags=cv2.INTER_LINEAR)
+
+    # Nuovo riferimento con la geometria corrente (es. dopo una mossa riconosciuta, quando i pezzi sono cambiati)
+    def set_reference(self, frame):
+        keypoints, descriptors = self.orb.detectAndCompute(self.rectify(frame), None)
+        self.reference = (np.array([point.pt for point in keypoints], dtype=np.float32), descriptors)
+
+    # Trasformazione dalla vista corrente a quella di riferimento e numero di corrispondenze coerenti
+    def estimate(self, frame):
+        reference_points, reference_descriptors = self.reference
+        keypoints, descriptors = self.orb.detectAndCompute(self.rectify(frame), None)
+        if descriptors is None or reference_descriptors is None or len(keypoints) < MIN_INLIERS:
+            return None, 0
+        pairs = self.matcher.knnMatch(descriptors, reference_descriptors, k=2)
+        matches = [pair[0] for pair in pairs if len(pair) == 2 and pair[0].distance < 0.75 * pair[1].distance]
+        if len(matches) < MIN_INLIERS:
+            return None, 0
+        current = np.array([keypoints[match.queryIdx].pt for match in matches], dtype=np.float32)
+        reference = reference_points[[match.trainIdx for match in matches]]
+        C, mask = cv2.findHomography(current, reference, cv2.RANSAC, 3.0)
+        if C is None:
+            return None, 0
+        return C, int(mask.sum())
+
+    # Elabora un frame (il controllo avviene solo ogni interval frame) e restituisce lo stato:
+    # TRACKING (nessuna correzione), CORRECTED (self.geometry aggiornata) oppure LOST (serve il riorientamento)
+    def update(self, frame):
+        self.frames += 1
+        if self.frames % self.interval:
+            return self.status if self.status == LOST else TRACKING
+        C, inliers = self.estimate(frame)
+        if C is None or inliers < MIN_INLIERS:
+            self.failures += 1 #es. una mano copre la scacchiera: la deriva si valuta al controllo successivo
+            if self.failures >= LOST_CHECKS:
+                self.status = LOST
+            return self.status if self.status == LOST else TRACKING
+        self.failures = 0
+        corrected = cv2.perspectiveTransform(self.board_corners.reshape(-1, 1, 2), np.linalg.inv(C)).reshape(-1, 2)
+        self.shift = float(np.linalg.norm(corrected - self.board_corners, axis=1).max() / self.square)
+        if self.shift > MAX_SHIFT:
+            self.status = LOST
+            return LOST
+        self.status = TRACKING
+        if self.shift < MIN_SHIFT:
+            return TRACKING
+        # la vista corretta è C @ S @ H: gli angoli della scacchiera nel frame si ottengono con l'omografia inversa
+        H = np.linalg.inv(self.S) @ C @ self.S @ self.geometry.H
+        w, h = self.geometry.output_size
+        rectified = np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]], dtype=np.float32).reshape(-1, 1, 2)
+        corners = cv2.perspectiveTransform(rectified, np.linalg.inv(H)).reshape(-1, 2)
+        self.geometry = BoardGeometry([(float(x), float(y)) for x, y in corners], self.geometry.output_size)
+        self.corrections += 1
+        return CORRECTED
+
+    def stats(self):
+        return {"status": self.status, "shift": round(self.shift, 3), "corrections": self.corrections}
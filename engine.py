@@ -0,0 +1,96 @@
+import threading
+import chess
+from lru_store import PersistentLRU
+
+MATE_SCORE = 10000 #valutazione in centipedoni usata per i matti
+
+# FEN normalizzata: i contatori di semimosse e mosse non cambiano l'analisi di Stockfish
+def normalize_fen(fen):
+    return " ".join(fen.split()[:4])
+
+def top_moves_key(fen, depth, number):
+    return f"top|{normalize_fen(fen)}|depth={depth}|multipv={number}"
+
+def evaluation_key(fen, depth):
+    return f"eval|{normalize_fen(fen)}|depth={depth}"
+
+def moves_key(fen, depth, moves_uci):
+    return f"moves|{normalize_fen(fen)}|depth={depth}|{','.join(sorted(moves_uci))}"
+
+# Punteggio UCI ("cp"/"mate") o di get_evaluation in centipedoni, dallo stesso punto di vista del punteggio
+def score_to_cp(score_type, value):
+    if score_type == "mate":
+        return MATE_SCORE - abs(value) if value > 0 else -MATE_SCORE + abs(value)
+    return value
+
+# Cache LRU delle analisi di Stockfish, opzionalmente salvata su SQLite per sopravvivere ai riavvii
+class EvaluationCache(PersistentLRU):
+    def __init__(self, max_size=4096, db_path=None):
+        super().__init__("evaluations", max_size, db_path)
+
+# Accesso a Stockfish condiviso da tutti i chiamanti (pulsante, chat, tool degli LLM):
+# le ricerche già fatte per la stessa posizione e gli stessi limiti costano una lettura della cache
+class CachedEngine:
+    def __init__(self, stockfish, cache, depth=15):
+        self.stockfish = stockfish
+        self.cache = cache
+        self.depth = depth
+        self._lock = threading.Lock() #il processo di Stockfish è unico, una ricerca alla volta
+
+    def top_moves(self, fen, number):
+        key = top_moves_key(fen, self.depth, number)
+        moves = self.cache.get(key)
+        if moves is None:
+            with self._lock:
+                self.stockfish.set_fen_position(fen)
+                moves = self.stockfish.get_top_moves(number)
+            self.cache.put(key, moves)
+        return moves
+
+    # Valuta in un'unica ricerca (MultiPV ristretta con searchmoves) un insieme di mosse candidate,
+    # oppure tutte le mosse legali, e restituisce la tabella ordinata con la perdita in centipedoni di ogni mossa
+    def evaluate_moves(self, fen, moves_uci=None):
+        board = chess.Board(fen)
+        legal_moves = [move.uci() for move in board.legal_moves]
+        requested = list(dict.fromkeys(moves_uci)) if moves_uci else legal_moves
+        candidates = [move for move in requested if move in legal_moves]
+        illegal = [move for move in requested if move not in legal_moves]
+        if not candidates:
+            return {"moves": [], "illegal": illegal}
+        key = moves_key(fen, self.depth, candidates)
+        table = self.cache.get(key)
+        if table is None:
+            with self._lock:
+                scores = self._search_moves(fen, candidates)
+            white_to_move = board.turn == chess.WHITE
+            best = max(score_to_cp(*score) for score in scores.values())
+            table = []
+            for move, (score_type, value) in sorted(scores.items(), key=lambda item: score_to_cp(*item[1]), reverse=True):
+                sign = 1 if white_to_move else -1 #valutazioni riportate dal punto di vista del bianco, come get_evaluation
+                table.append({
+                    "Move": move,
+                    "Centipawn": value * sign if score_type == "cp" else None,
+                    "Mate": value * sign if score_type == "mate" else None,
+                    "CentipawnLoss": best - score_to_cp(score_type, value),
+                })
+            self.cache.put(key, table)
+        return {"moves": table, "illegal": illegal}
+
+    # Ricerca UCI "go searchmoves" con una linea MultiPV per ogni mossa candidata
+    def _search_moves(self, fen, candidates):
+        stockfish = self.stockfish
+        stockfish.set_fen_position(fen)
+        stockfish._set_option("MultiPV", len(candidates), False)
+        stockfish._put(f"go depth {self.depth} searchmoves {' '.join(candidates)}")
+        scores = {}
+        while True:
+            parts = stockfish._read_line().split()
+            if not parts:
+                continue
+            if parts[0] == "bestmove":
+                break
+            if parts[0] == "info" and "multipv" in parts and "score" in parts and "pv" in parts:
+                score_index = parts.index("score")
+                scores[parts[parts.index("pv") + 1]] = (parts[score_index + 1], int(parts[score_index + 2]))
+        stockfish._set_option("MultiPV", stockfish._parameters["MultiPV"])
+        return scores
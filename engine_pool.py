@@ -0,0 +1,134 @@
+import argparse
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import chess
+import chess.pgn
+from stockfish import Stockfish
+from engine import MATE_SCORE, CachedEngine, EvaluationCache, evaluation_key, score_to_cp
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STOCKFISH_PATH = os.path.join(BASE_DIR, "Stockfish", "src", "stockfish")
+BLUNDER_CP = 300 #perdita in centipedoni oltre la quale una mossa è considerata un errore grave
+
+# Converte la valutazione di Stockfish (dal punto di vista del bianco) in centipedoni
+def evaluation_to_cp(evaluation, board):
+    if board.is_checkmate():
+        return -MATE_SCORE if board.turn == chess.WHITE else MATE_SCORE
+    return score_to_cp(evaluation["type"], evaluation["value"])
+
+# Pool di processi Stockfish per analizzare molte posizioni in parallelo (es. tutta la partita a fine gioco)
+class EnginePool:
+    def __init__(self, stockfish_path=STOCKFISH_PATH, size=None, threads=1, hash_mb=64, depth=15, cache=None):
+        self.size = size or max(1, (os.cpu_count() or 1) // threads)
+        self.depth = depth
+        self.cache = cache if cache is not None else EvaluationCache()
+        self.processes = [Stockfish(stockfish_path, depth=depth, parameters={"Threads": threads, "Hash": hash_mb}) for _ in range(self.size)]
+        self.engines = queue.Queue()
+        for stockfish in self.processes:
+            self.engines.put(stockfish)
+
+    @contextmanager
+    def engine(self):
+        stockfish = self.engines.get()
+        try:
+            yield stockfish
+        finally:
+            self.engines.put(stockfish)
+
+    # Valutazione di una singola posizione con il primo motore libero
+    def evaluate(self, fen):
+        key = evaluation_key(fen, self.depth)
+        evaluation = self.cache.get(key)
+        if evaluation is None:
+            with self.engine() as stockfish:
+                stockfish.set_fen_position(fen)
+                evaluation = stockfish.get_evaluation()
+            self.cache.put(key, evaluation)
+        return evaluation
+
+    # Classifica di un insieme di mosse candidate (vedi CachedEngine.evaluate_moves) sul primo motore libero:
+    # più richieste contemporanee vengono servite da processi diversi
+    def evaluate_moves(self, fen, moves_uci=None):
+        with self.engine() as stockfish:
+            return CachedEngine(stockfish, self.cache, self.depth).evaluate_moves(fen, moves_uci)
+
+    def evaluate_positions(self, fens):
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(self.evaluate, fens))
+
+    # Analizza tutte le posizioni della partita e calcola per ogni mossa la perdita in centipedoni
+    # positions: lista di FEN in ordine di gioco, moves: eventuale lista delle mosse in SAN che le collegano.
+    # Le transizioni senza mossa (None: risincronizzazioni e cambi di turno manuali) non sono state giocate e vengono saltate
+    def analyse_game(self, positions, moves=None):
+        start = time.perf_counter()
+        boards = [chess.Board(fen) for fen in positions]
+        scores = [evaluation_to_cp(evaluation, board) for evaluation, board in zip(self.evaluate_positions(positions), boards)]
+        elapsed = time.perf_counter() - start
+        analysis = []
+        for index in range(len(positions) - 1):
+            if moves and moves[index] is None:
+                continue
+            white_moved = boards[index].turn == chess.WHITE
+            before, after = scores[index], scores[index + 1]
+            loss = max(0, before - after if white_moved else after - before)
+            analysis.append({
+                "ply": index + 1,
+                "move": moves[index] if moves else None,
+                "fen": positions[index + 1],
+                "evaluation": after / 100,
+                "cp_loss": loss,
+                "blunder": loss >= BLUNDER_CP,
+            })
+        stats = {
+            "positions": len(positions),
+            "engines": self.size,
+            "seconds": round(elapsed, 2),
+            "positions_per_second": round(len(positions) / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+        return analysis, stats
+
+    def analyse_pgn(self, pgn_file):
+        game = chess.pgn.read_game(pgn_file)
+        board = game.board()
+        positions, moves = [board.fen()], []
+        for move in game.mainline_moves():
+            moves.append(board.san(move))
+            board.push(move)
+            positions.append(board.fen())
+        return self.analyse_game(positions, moves)
+
+    # Chiude tutti i processi Stockfish, anche quelli in uso in questo momento
+    def close(self):
+        while not self.engines.empty():
+            self.engines.get_nowait()
+        for stockfish in self.processes:
+            stockfish._put("quit")
+
+def print_analysis(analysis, stats):
+    for entry in analysis:
+        flag = " ??" if entry["blunder"] else ""
+        print(f"{entry['ply']:>4} {entry['move'] or '-':<8} {entry['evaluation']:>+8.2f}  perdita {entry['cp_loss']:>5}{flag}")
+    print(f"{stats['positions']} posizioni in {stats['seconds']} s ({stats['positions_per_second']} posizioni/s, {stats['engines']} motori)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analisi parallela di una partita con un pool di processi Stockfish")
+    parser.add_argument("game", help="file PGN oppure file di testo con una FEN per riga")
+    parser.add_argument("--engines", type=int, default=None, help="numero di processi Stockfish (default: core disponibili / threads)")
+    parser.add_argument("--threads", type=int, default=1, help="Threads di ogni processo Stockfish")
+    parser.add_argument("--hash", type=int, default=64, help="Hash (MB) di ogni processo Stockfish")
+    parser.add_argument("--depth", type=int, default=15)
+    parser.add_argument("--stockfish", default=STOCKFISH_PATH)
+    args = parser.parse_args()
+    pool = EnginePool(args.stockfish, size=args.engines, threads=args.threads, hash_mb=args.hash, depth=args.depth)
+    try:
+        with open(args.game, encoding="utf-8") as file:
+            if args.game.lower().endswith(".pgn"):
+                analysis, stats = pool.analyse_pgn(file)
+            else:
+                analysis, stats = pool.analyse_game([line.strip() for line in file if line.strip()])
+        print_analysis(analysis, stats)
+    finally:
+        pool.close()
@@ -0,0 +1,170 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import cv2
+import numpy as np
+import yaml
+from ultralytics import YOLO
+from detector import DETECTION_MODEL, ROI_IMGSZ, ChessPieceDetector
+from recognize_position import board_geometry_from_detections, detections_to_state, load_labels
+from replay import IMAGE_EXTENSIONS
+
+DATASET_FILE = "dataset.yaml"
+IMAGE_SIZE = ROI_IMGSZ #dimensione con cui il detector elabora la regione della scacchiera dopo l'orientamento
+CALIBRATION_IMAGES = 300 #immagini della validazione usate per calibrare la quantizzazione INT8
+MAX_MAP_DROP = 0.02 #calo massimo di mAP50-95 ammesso rispetto al modello PyTorch
+MAX_SQUARE_DROP = 0.01 #calo massimo dell'accuratezza per casella ammesso rispetto al modello PyTorch
+
+# Immagini della validazione indicate in dataset.yaml, con il file di etichette YOLO corrispondente (images/... -> labels/...)
+def validation_images(data_file=DATASET_FILE):
+    with open(data_file, encoding="utf-8") as file:
+        data = yaml.safe_load(file)
+    root = data.get("path", "")
+    if not os.path.isabs(root):
+        root = os.path.join(os.path.dirname(os.path.abspath(data_file)), root)
+    folder = os.path.join(root, data["val"])
+    samples = []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            image_path = os.path.join(folder, name)
+            labels_path = os.path.splitext(image_path.replace(f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"))[0] + ".txt"
+            samples.append((image_path, labels_path))
+    return samples
+
+# Ridimensiona mantenendo le proporzioni e completa con il grigio di YOLO, come il preprocessing di ultralytics
+def letterbox(image, size):
+    height, width = image.shape[:2]
+    scale = min(size / height, size / width)
+    resized = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_LINEAR)
+    top = (size - resized.shape[0]) // 2
+    left = (size - resized.shape[1]) // 2
+    return cv2.copyMakeBorder(resized, top, size - resized.shape[0] - top, left, size - resized.shape[1] - left, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+
+# Tensori di ingresso (1x3xNxN, RGB in [0, 1]) per la calibrazione della quantizzazione statica di onnxruntime
+class CalibrationReader:
+    def __init__(self, input_name, image_paths, size):
+        self.input_name = input_name
+        self.image_paths = iter(image_paths)
+        self.size = size
+
+    def get_next(self):
+        for image_path in self.image_paths:
+            image = cv2.imread(image_path)
+            if image is None:
+                continue
+            tensor = letterbox(image, self.size)[:, :, ::-1].transpose(2, 0, 1)
+            return {self.input_name: np.ascontiguousarray(tensor[np.newaxis], dtype=np.float32) / 255.0}
+        return None
+
+# Esporta i pesi PyTorch in ONNX; con int8 crea anche <modello>-int8.onnx quantizzato con le immagini di validazione
+def export_onnx(weights, imgsz=IMAGE_SIZE, int8=False, data_file=DATASET_FILE, calibration_images=CALIBRATION_IMAGES, dynamic=False):
+    onnx_path = YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=dynamic, simplify=True)
+    if not int8:
+        return onnx_path
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+    base = os.path.splitext(onnx_path)[0]
+    prepared_path = base + "-prep.onnx"
+    int8_path = base + "-int8.onnx"
+    quant_pre_process(onnx_path, prepared_path)
+    input_name = onnxruntime.InferenceSession(prepared_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    image_paths = [image_path for image_path, _ in validation_images(data_file)[:calibration_images]]
+    # la testa di detection resta in virgola mobile: quantizzarla degrada molto le coordinate delle box
+    quantize_static(prepared_path, int8_path, CalibrationReader(input_name, image_paths, imgsz), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True,
+                    calibrate_method=CalibrationMethod.MinMax, nodes_to_exclude=head_nodes(prepared_path))
+    os.remove(prepared_path)
+    return int8_path
+
+# Nodi dell'ultimo blocco del grafo (decodifica delle box e concatenazione finale), esclusi dalla quantizzazione
+def head_nodes(onnx_path):
+    import onnx
+    nodes = onnx.load(onnx_path).graph.node
+    return [node.name for node in nodes if "/model.23/" in node.name and node.op_type in ("Concat", "Split", "Sigmoid", "Mul", "Add", "Sub", "Div", "Softmax")]
+
+# Esporta in OpenVINO; con int8 la quantizzazione NNCF di ultralytics usa la validazione di dataset.yaml come calibrazione
+def export_openvino(weights, imgsz=IMAGE_SIZE, int8=False, data_file=DATASET_FILE, calibration_images=CALIBRATION_IMAGES, dynamic=False):
+    kwargs = {"data": data_file, "fraction": min(1.0, calibration_images / max(1, len(validation_images(data_file))))} if int8 else {}
+    return YOLO(weights).export(format="openvino", imgsz=imgsz, int8=int8, dynamic=dynamic, **kwargs)
+
+# Accuratezza per casella sulle immagini di validazione: la scacchiera viene orientata con le torri delle etichette,
+# poi le 64 caselle della posizione ottenuta dal modello vengono confrontate con quelle della posizione delle etichette.
+# Come nell'applicazione, il modello elabora solo la regione della scacchiera ridimensionata a imgsz.
+# Le immagini senza le 4 torri etichettate non hanno una scacchiera di riferimento e vengono saltate
+def square_accuracy(detector, samples, imgsz=IMAGE_SIZE):
+    correct = total = boards = exact = 0
+    for image_path, labels_path in samples:
+        if not os.path.exists(labels_path):
+            continue
+        image = cv2.imread(image_path)
+        if image is None:
+            continue
+        labels = load_labels(labels_path)
+        geometry = board_geometry_from_detections(labels, image.shape)
+        if geometry is None:
+            continue
+        truth = detections_to_state(geometry, labels, image.shape)
+        predicted = detections_to_state(geometry, detector.detect_roi(image, geometry.roi(image.shape), imgsz=imgsz), image.shape)
+        matches = 64 - int(np.count_nonzero(truth.changed_mask(predicted)))
+        correct += matches
+        total += 64
+        boards += 1
+        exact += matches == 64
+    return {"boards": boards, "square_accuracy": round(correct / total, 4) if total else None, "board_accuracy": round(exact / boards, 4) if boards else None}
+
+# mAP sulla validazione (metriche di ultralytics) e accuratezza per casella di un modello PyTorch o esportato
+def evaluate(weights, data_file=DATASET_FILE, imgsz=IMAGE_SIZE):
+    detector = ChessPieceDetector(weights, warmup=False, roi_imgsz=imgsz)
+    metrics = detector.model.val(data=data_file, imgsz=imgsz, split="val", batch=1, plots=False, verbose=False)
+    report = {"weights": str(weights), "map50": round(float(metrics.box.map50), 4), "map50_95": round(float(metrics.box.map), 4)}
+    report.update(square_accuracy(detector, validation_images(data_file), imgsz))
+    return report
+
+# Confronto con il modello PyTorch: elenco dei motivi per cui l'esportazione va scartata (vuoto se è accettabile)
+def accuracy_gate(reference, candidate, max_map_drop=MAX_MAP_DROP, max_square_drop=MAX_SQUARE_DROP):
+    failures = []
+    if reference["map50_95"] - candidate["map50_95"] > max_map_drop:
+        failures.append(f"mAP50-95 {reference['map50_95']} -> {candidate['map50_95']} (calo massimo {max_map_drop})")
+    if reference["square_accuracy"] is not None and candidate["square_accuracy"] is not None:
+        if reference["square_accuracy"] - candidate["square_accuracy"] > max_square_drop:
+            failures.append(f"accuratezza per casella {reference['square_accuracy']} -> {candidate['square_accuracy']} (calo massimo {max_square_drop})")
+    return failures
+
+def remove_export(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Esporta il detector per l'inferenza su CPU (ONNX Runtime o OpenVINO, anche INT8) e lo confronta con il modello PyTorch")
+    parser.add_argument("--weights", default=DETECTION_MODEL, help="pesi PyTorch addestrati")
+    parser.add_argument("--format", choices=["onnx", "openvino"], default="onnx")
+    parser.add_argument("--int8", action="store_true", help="quantizza in INT8 usando come calibrazione le immagini di validazione")
+    parser.add_argument("--data", default=DATASET_FILE)
+    parser.add_argument("--imgsz", type=int, default=IMAGE_SIZE, help="lato dell'ingresso del modello, lo stesso usato dal detector per la regione della scacchiera (DETECTION_IMGSZ)")
+    parser.add_argument("--dynamic", action="store_true", help="esporta con dimensioni di ingresso e batch variabili (altrimenti il detector usa sempre imgsz ed elabora le scacchiere una alla volta)")
+    parser.add_argument("--calibration-images", type=int, default=CALIBRATION_IMAGES)
+    parser.add_argument("--max-map-drop", type=float, default=MAX_MAP_DROP)
+    parser.add_argument("--max-square-drop", type=float, default=MAX_SQUARE_DROP)
+    parser.add_argument("--skip-check", action="store_true", help="esporta senza il controllo di accuratezza")
+    parser.add_argument("--keep-rejected", action="store_true", help="non elimina il modello esportato se non supera il controllo")
+    args = parser.parse_args()
+    export = export_onnx if args.format == "onnx" else export_openvino
+    exported = export(args.weights, args.imgsz, args.int8, args.data, args.calibration_images, args.dynamic)
+    print(f"Modello esportato in {exported}")
+    if args.skip_check:
+        sys.exit(0)
+    reference = evaluate(args.weights, args.data, args.imgsz)
+    candidate = evaluate(exported, args.data, args.imgsz)
+    failures = accuracy_gate(reference, candidate, args.max_map_drop, args.max_square_drop)
+    print(json.dumps({"pytorch": reference, "export": candidate, "accepted": not failures}, indent=2))
+    if failures:
+        for failure in failures:
+            print(f"SCARTATO {failure}")
+        if not args.keep_rejected:
+            remove_export(exported)
+        sys.exit(1)
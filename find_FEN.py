@@ -39,7 +39,9 @@ PIECE_MAP = {
     6: 'p', 7: 'r', 8: 'n', 9: 'b', 10: 'q', 11: 'k',
     12: None  # casella vuota
 }
-def dict_to_fen(position_dict, turn, castling_options, halfmove_clock, fullmove_number, en_passant):
+# Senza turn restituisce solo la parte della FEN relativa ai pezzi, con turn la FEN completa.
+# Il riconoscimento usa board_state.BoardState, che produce la stessa FEN senza dizionario
+def dict_to_fen(position_dict, turn=None, castling_options="-", halfmove_clock=0, fullmove_number=1, en_passant="-"):
     fen_rows = []
     # Costruzione riga per riga (dalla 8 alla 1)
     for rank in range(8, 0, -1):
@@ -60,28 +62,8 @@ def dict_to_fen(position_dict, turn, castling_options, halfmove_clock, fullmove_
             row += str(empty_count)
         fen_rows.append(row)
     fen_board = '/'.join(fen_rows)
+    if turn is None:
+        return fen_board
     fen_turn = 'w' if turn.lower() == 'white' else 'b'
     full_fen = f"{fen_board} {fen_turn} {castling_options} {en_passant} {str(halfmove_clock)} {str(fullmove_number)}"
     return full_fen
-
-def dict_to_fen(position_dict):
-    fen_rows = []
-    for rank in range(8, 0, -1):
-        row = ''
-        empty_count = 0
-        for file in 'abcdefgh':
-            square = f'{file}{rank}'
-            value = position_dict.get(square, 12)  # default a casella vuota
-            symbol = PIECE_MAP[value]
-            if symbol is None:
-                empty_count += 1
-            else:
-                if empty_count > 0:
-                    row += str(empty_count)
-                    empty_count = 0
-                row += symbol
-        if empty_count > 0:
-            row += str(empty_count)
-        fen_rows.append(row)
-    fen_board = '/'.join(fen_rows)
-    return fen_board
\ No newline at end of file
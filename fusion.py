@@ -0,0 +1,66 @@
+from collections import deque
+import numpy as np
+from board_state import SQUARE_NAMES, BoardState
+
+EMPTY_CLASS = 12
+NUM_CLASSES = 13
+
+# Converte la parte della FEN relativa ai pezzi in una matrice 8x8 di classi (riga 0 = traversa 8)
+def classes_from_board_fen(board_fen):
+    return BoardState.from_board_fen(board_fen).squares.astype(np.int64)
+
+# Fusione temporale delle detection: per ogni casella mantiene le probabilità delle classi degli ultimi frame
+# e accetta un cambiamento solo se è stabile per stable_frames frame consecutivi
+class SquareFusion:
+    def __init__(self, board_fen, window=4, stable_frames=3, min_confidence=0.5):
+        self.window = deque(maxlen=window)
+        self.stable_frames = stable_frames
+        self.min_confidence = min_confidence
+        self.committed = classes_from_board_fen(board_fen)
+        self.confidence = np.ones((8, 8), dtype=np.float32)
+
+    # Probabilità per casella di un singolo frame: una casella senza bounding box è vuota,
+    # una casella con bounding box ha probabilità conf per la classe rilevata e il resto diviso tra gli altri pezzi
+    def frame_probabilities(self, rows, cols, classes, confs):
+        probs = np.zeros((8, 8, NUM_CLASSES), dtype=np.float32)
+        probs[:, :, EMPTY_CLASS] = 1.0
+        # a parità di casella vince la bounding box più sicura (assegnate in ordine di confidenza crescente)
+        order = np.argsort(confs)
+        rows, cols, classes, confs = rows[order], cols[order], classes[order], confs[order]
+        probs[rows, cols, :] = ((1.0 - confs) / (NUM_CLASSES - 2))[:, None]
+        probs[rows, cols, EMPTY_CLASS] = 0.0
+        probs[rows, cols, classes] = confs
+        return probs
+
+    # Aggiunge un frame e restituisce True se la posizione accettata è cambiata
+    def observe(self, rows, cols, classes, confs):
+        self.window.append(self.frame_probabilities(rows, cols, classes, confs))
+        history = np.stack(self.window)
+        mean = history.mean(axis=0)
+        best = mean.argmax(axis=2)
+        best_confidence = mean.max(axis=2)
+        recent = history[-self.stable_frames:].argmax(axis=3)
+        stable = (len(self.window) >= self.stable_frames) & (recent == best).all(axis=0) & (best_confidence >= self.min_confidence)
+        changed = stable & (best != self.committed)
+        self.committed[changed] = best[changed]
+        self.confidence = np.take_along_axis(mean, self.committed[:, :, None], axis=2)[:, :, 0]
+        return bool(changed.any())
+
+    def observe_detections(self, geometry, detections, frame_shape):
+        rows, cols = geometry.detections_to_cells(detections, frame_shape)
+        return self.observe(rows, cols, detections[:, 0].astype(np.int64), detections[:, 5])
+
+    # Dimentica i frame precedenti (es. dopo una risincronizzazione, perché non descrivono più la posizione della partita)
+    def reset(self, board_fen=None):
+        self.window.clear()
+        if board_fen is not None:
+            self.committed = classes_from_board_fen(board_fen)
+            self.confidence = np.ones((8, 8), dtype=np.float32)
+
+    # Posizione accettata come BoardState (copia: la fusione continua ad aggiornare self.committed)
+    def state(self):
+        return BoardState(self.committed.astype(np.uint8))
+
+    # Caselle con confidenza inferiore alla soglia, in notazione scacchistica
+    def uncertain_squares(self, threshold=0.7):
+        return SQUARE_NAMES[self.confidence < threshold].tolist()
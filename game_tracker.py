@@ -0,0 +1,141 @@
+import chess
+from board_state import BoardState
+
+UNCHANGED = "unchanged"
+MOVED = "moved"
+RESYNC = "resync"
+REJECTED = "rejected"
+
+# Numero di caselle diverse tra due scacchiere (una casella con il pezzo sbagliato conta 2, una casella vuota/occupata conta 1)
+def board_distance(board, detected):
+    distance = 0
+    for color in chess.COLORS:
+        for piece_type in chess.PIECE_TYPES:
+            distance += chess.popcount(board.pieces_mask(piece_type, color) ^ detected.pieces_mask(piece_type, color))
+    return distance
+
+# Numero di pezzi della prima posizione che non si trovano più sulla stessa casella nella seconda (FEN o BoardState)
+def count_moved_pieces(fen1, fen2):
+    state1 = fen1 if isinstance(fen1, BoardState) else BoardState.from_board_fen(fen1)
+    state2 = fen2 if isinstance(fen2, BoardState) else BoardState.from_board_fen(fen2)
+    return state1.moved_pieces(state2)
+
+# Tiene traccia della partita a partire dalle posizioni riconosciute: tra le mosse legali sceglie quella
+# che meglio spiega la nuova occupazione delle caselle, così turno, arrocchi, en passant e storico delle mosse sono corretti.
+# Se nessuna mossa (o coppia di mosse) è compatibile la scacchiera viene risincronizzata sulla posizione rilevata,
+# purché sia plausibile, venga confermata da più aggiornamenti o sia richiesta esplicitamente (force)
+class GameTracker:
+    def __init__(self, board=None, tolerance=2, max_plies=2, resync_confirmations=2):
+        self.board = board or chess.Board()
+        self.tolerance = tolerance #differenza ammessa dovuta ad errori di riconoscimento (2 = un pezzo scambiato)
+        self.max_plies = max_plies #numero massimo di mosse consecutive cercate tra due riconoscimenti
+        self.resync_confirmations = resync_confirmations #aggiornamenti identici (senza mosse nel mezzo) per accettare una posizione non plausibile
+        self.resync_candidate = None
+        self.resync_count = 0
+        self.history = [self.board.fen()] #tutte le posizioni della partita, anche attraverso le risincronizzazioni
+        self.history_moves = [] #mossa in SAN che porta a ogni posizione di history (None per le risincronizzazioni)
+        self.last_moves = []
+
+    # Cerca la sequenza di mosse legali (fino a max_plies) che porta più vicino alla posizione rilevata.
+    # La ricerca avviene su una copia: self.board viene letta anche dai thread dell'assistente e di Stockfish
+    def best_sequence(self, detected):
+        board = self.board.copy(stack=False)
+        best_moves, best_score = [], None
+        for move in board.legal_moves:
+            board.push(move)
+            score = board_distance(board, detected)
+            if best_score is None or score < best_score:
+                best_moves, best_score = [move], score
+            if score > 0 and self.max_plies > 1:
+                for reply in board.legal_moves:
+                    board.push(reply)
+                    reply_score = board_distance(board, detected)
+                    board.pop()
+                    # una sequenza di due mosse deve spiegare la posizione meglio di una singola mossa
+                    if reply_score < best_score:
+                        best_moves, best_score = [move, reply], reply_score
+            board.pop()
+            if best_score == 0 and len(best_moves) == 1:
+                break
+        return best_moves, best_score
+
+    # Aggiorna la partita con la posizione rilevata: BoardState oppure la parte della FEN relativa ai pezzi.
+    # Con force una posizione che nessuna mossa spiega viene adottata subito (richiesta esplicita dell'utente)
+    def update(self, position, force=False):
+        detected = position.to_base_board() if isinstance(position, BoardState) else chess.BaseBoard(position)
+        current_score = board_distance(self.board, detected)
+        self.last_moves = []
+        # la candidata alla risincronizzazione sopravvive ai frame invariati: mentre la fusione non ha ancora
+        # accettato la nuova posizione i primi frame di ogni riconoscimento coincidono con la partita
+        if current_score == 0:
+            return UNCHANGED
+        moves, score = self.best_sequence(detected)
+        if moves and score <= self.tolerance and score < current_score:
+            for move in moves:
+                self.last_moves.append(self.board.san(move))
+                self.board.push(move)
+                self.history.append(self.board.fen())
+                self.history_moves.append(self.last_moves[-1])
+            self.resync_candidate = None
+            return MOVED
+        if current_score <= self.tolerance:
+            return UNCHANGED #differenza attribuita ad un errore di riconoscimento
+        if not force and not self.confirm_resync(detected):
+            return REJECTED
+        return RESYNC if self.resync(detected.board_fen()) else REJECTED
+
+    # Posizione compatibile con la partita: nessun pedone sulle traverse estreme e al massimo max_plies pezzi
+    # in meno (le catture possibili tra due riconoscimenti). Una mano o un'occlusione, che la fusione vede come
+    # caselle vuote, non lo è; lo schieramento iniziale (nuova partita) lo è sempre
+    def plausible(self, detected):
+        if detected.board_fen() == chess.STARTING_BOARD_FEN:
+            return True
+        if detected.pawns & chess.BB_BACKRANKS:
+            return False
+        missing = chess.popcount(self.board.occupied) - chess.popcount(detected.occupied)
+        return 0 <= missing <= self.max_plies
+
+    # Una posizione che nessuna mossa spiega viene accettata subito se è plausibile,
+    # altrimenti solo dopo resync_confirmations aggiornamenti con la stessa posizione, senza mosse nel mezzo
+    def confirm_resync(self, detected):
+        board_fen = detected.board_fen()
+        self.resync_count = self.resync_count + 1 if board_fen == self.resync_candidate else 1
+        self.resync_candidate = board_fen
+        return self.plausible(detected) or self.resync_count >= self.resync_confirmations
+
+    # Imposta la posizione rilevata: tocca all'avversario e restano solo i diritti d'arrocco ancora compatibili.
+    # Lo schieramento iniziale è una nuova partita: tocca al bianco con tutti gli arrocchi
+    def resync(self, board_fen, turn=None):
+        self.resync_candidate = None
+        if board_fen == chess.STARTING_BOARD_FEN and turn is None:
+            self.board = chess.Board()
+            self.history.append(self.board.fen())
+            self.history_moves.append(None)
+            return True
+        board = chess.Board(f"{board_fen} {'w' if self.board.turn == chess.BLACK else 'b'} - - 0 1")
+        if turn is not None:
+            board.turn = turn
+        king_errors = chess.STATUS_NO_WHITE_KING | chess.STATUS_NO_BLACK_KING | chess.STATUS_TOO_MANY_KINGS
+        if board.status() & king_errors:
+            return False
+        board.castling_rights = self.board.castling_rights
+        board.castling_rights = board.clean_castling_rights()
+        board.fullmove_number = self.board.fullmove_number
+        self.board = board
+        self.history.append(self.board.fen())
+        self.history_moves.append(None)
+        return True
+
+    # Partita divisa nei tratti tra una risincronizzazione e l'altra: (FEN di partenza, mosse in SAN) per ogni tratto
+    def segments(self):
+        segments = [(self.history[0], [])]
+        for fen, move in zip(self.history[1:], self.history_moves):
+            if move is None:
+                segments.append((fen, []))
+            else:
+                segments[-1][1].append(move)
+        return segments
+
+    # Cambio manuale del turno
+    def switch_turn(self):
+        self.resync(self.board.board_fen(), turn=not self.board.turn)
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from lru_store import PersistentLRU
+
+MAX_TOOL_ROUNDS = 3 #turni di chiamate a funzione concessi al modello prima della risposta finale
+
+# Il prompt di sistema viene letto dal disco una sola volta
+@lru_cache(maxsize=None)
+def load_system_prompt(prompt_filename):
+    with open(prompt_filename, 'r', encoding='utf-8') as file:
+        return file.read()
+
+# Versione del prompt: cambia quando cambiano il prompt di sistema o gli strumenti, invalidando le risposte salvate
+def prompt_version(system_prompt, tools):
+    return hashlib.sha1((system_prompt + json.dumps(tools, sort_keys=True)).encode("utf-8")).hexdigest()[:12]
+
+# Domanda normalizzata: maiuscole, punteggiatura e spazi non cambiano la risposta
+def normalize_question(question):
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+def response_key(fen, question, backend):
+    return f"{fen}|{normalize_question(question)}|{backend.name}|{backend.prompt_version}"
+
+# Cache delle risposte dell'assistente con scadenza (ttl in secondi) e numero massimo di elementi,
+# opzionalmente salvata su SQLite. Tiene il conto del tempo risparmiato rispetto alla richiesta originale
+class ResponseCache(PersistentLRU):
+    def __init__(self, max_size=256, ttl=3600, db_path=None):
+        super().__init__("assistant_responses", max_size, db_path)
+        self.ttl = ttl
+        self.saved_seconds = 0.0
+        if self.db is not None:
+            self.db.execute(f"DELETE FROM {self.table} WHERE json_extract(value, '$.created') < ?", (time.time() - ttl,))
+            self.db.commit()
+
+    def is_valid(self, entry):
+        return time.time() - entry["created"] <= self.ttl
+
+    def get(self, key):
+        entry = super().get(key)
+        if entry is None:
+            return None
+        with self._lock:
+            self.saved_seconds += entry["latency"]
+        return entry["text"]
+
+    def put(self, key, text, latency):
+        super().put(key, {"text": text, "latency": latency, "created": time.time()})
+
+    def stats(self):
+        return {**super().stats(), "saved_seconds": round(self.saved_seconds, 1)}
+
+# Chiamata a funzione richiesta dal modello, in un formato comune a tutti i backend
+class ToolCall:
+    def __init__(self, call_id, name, args):
+        self.id = call_id
+        self.name = name
+        self.args = args
+
+# Backend OpenAI: il client (e quindi il pool di connessioni HTTP keep-alive) viene creato una sola volta.
+# Gli SDK dei due servizi vengono importati solo da chi li usa, così FakeBackend funziona anche senza
+class OpenAIBackend:
+    def __init__(self, api_key, model, system_prompt, tools):
+        from openai import OpenAI
+        self.name = f"openai/{model}"
+        self.prompt_version = prompt_version(system_prompt, tools)
+        self.client = OpenAI(api_key=api_key)
+        self.model = model
+        self.system_prompt = system_prompt
+        self.tools = tools
+
+    def new_conversation(self, user_prompt):
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    # Richiesta in streaming: i token vengono passati a on_token appena arrivano.
+    # Restituisce il testo completo e le eventuali chiamate a funzione, aggiungendo la risposta alla conversazione
+    def complete(self, conversation, on_token=None, use_tools=True):
+        kwargs = {"tools": self.tools, "tool_choice": "auto"} if use_tools else {}
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=conversation,
+            temperature=0.0,
+            stream=True,
+            **kwargs
+        )
+        text = ""
+        partial_calls = {}
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                text += delta.content
+                if on_token:
+                    on_token(delta.content)
+            for call in delta.tool_calls or []:
+                partial = partial_calls.setdefault(call.index, {"id": "", "name": "", "arguments": ""})
+                if call.id:
+                    partial["id"] = call.id
+                if call.function and call.function.name:
+                    partial["name"] += call.function.name
+                if call.function and call.function.arguments:
+                    partial["arguments"] += call.function.arguments
+        tool_calls = [ToolCall(call["id"], call["name"], json.loads(call["arguments"] or "{}")) for _, call in sorted(partial_calls.items())]
+        message = {"role": "assistant", "content": text or None}
+        if tool_calls:
+            message["tool_calls"] = [
+                {"id": call.id, "type": "function", "function": {"name": call.name, "arguments": json.dumps(call.args)}}
+                for call in tool_calls
+            ]
+        conversation.append(message)
+        return text, tool_calls
+
+    def add_tool_results(self, conversation, results):
+        for call, result in results:
+            conversation.append({
+                "role": "tool",
+                "tool_call_id": call.id,
+                "name": call.name,
+                "content": result
+            })
+
+# Backend Gemini: configurazione, modello e dichiarazione delle funzioni vengono creati una sola volta
+class GeminiBackend:
+    def __init__(self, api_key, model, system_prompt, tools):
+        import google.generativeai as genai
+        self.name = f"gemini/{model}"
+        self.prompt_version = prompt_version(system_prompt, tools)
+        genai.configure(api_key=api_key)
+        function_declarations = [
+            genai.types.FunctionDeclaration(name=tool["function"]["name"], description=tool["function"]["description"], parameters=tool["function"]["parameters"])
+            for tool in tools
+        ]
+        self.tools = [genai.types.Tool(function_declarations=function_declarations)]
+        self.model = genai.GenerativeModel(
+            model_name=model,
+            system_instruction=system_prompt,
+            generation_config=genai.types.GenerationConfig(temperature=0.0)
+        )
+
+    # Il system_prompt è gestito a livello di modello, il primo messaggio è quello dell'utente
+    def new_conversation(self, user_prompt):
+        import google.ai.generativelanguage as glm
+        return [glm.Content(role="user", parts=[glm.Part(text=user_prompt)])]
+
+    def complete(self, conversation, on_token=None, use_tools=True):
+        import google.ai.generativelanguage as glm
+        tool_config = None if use_tools else {"function_calling_config": {"mode": "NONE"}}
+        stream = self.model.generate_content(conversation, tools=self.tools, tool_config=tool_config, stream=True)
+        text = ""
+        tool_calls = []
+        parts = []
+        for chunk in stream:
+            if not chunk.candidates or not chunk.candidates[0].content:
+                continue
+            for part in chunk.candidates[0].content.parts:
+                parts.append(part)
+                if part.function_call:
+                    tool_calls.append(ToolCall(str(len(tool_calls)), part.function_call.name, dict(part.function_call.args)))
+                elif part.text:
+                    text += part.text
+                    if on_token:
+                        on_token(part.text)
+        conversation.append(glm.Content(role="model", parts=parts))
+        return text, tool_calls
+
+    def add_tool_results(self, conversation, results):
+        import google.ai.generativelanguage as glm
+        parts = [
+            glm.Part(function_response=glm.FunctionResponse(name=call.name, response={"result": result}))
+            for call, result in results
+        ]
+        conversation.append(glm.Content(role="function", parts=parts))
+
+# Backend locale senza rete, per provare l'interfaccia e la chat offline.
+# Nei primi tool_rounds turni richiede le funzioni indicate in tool_calls, poi risponde con il testo fornito
+class FakeBackend:
+    def __init__(self, reply="Posizione equilibrata.", tool_calls=None, token_delay=0.0, tool_rounds=1):
+        self.name = "fake"
+        self.reply = reply
+        self.tool_calls = tool_calls or []
+        self.prompt_version = prompt_version(reply, self.tool_calls)
+        self.token_delay = token_delay
+        self.tool_rounds = tool_rounds
+
+    def new_conversation(self, user_prompt):
+        return [{"role": "user", "content": user_prompt}]
+
+    def complete(self, conversation, on_token=None, use_tools=True):
+        rounds = sum(1 for message in conversation if message.get("tool_calls"))
+        if use_tools and self.tool_calls and rounds < self.tool_rounds:
+            tool_calls = [ToolCall(str(index), name, args) for index, (name, args) in enumerate(self.tool_calls)]
+            conversation.append({"role": "assistant", "content": None, "tool_calls": tool_calls})
+            return "", tool_calls
+        tool_results = [message["content"] for message in conversation if message["role"] == "tool"]
+        text = self.reply + ("\n" + "\n".join(tool_results) if tool_results else "")
+        for token in text.split(" "):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            if on_token:
+                on_token(token + " ")
+        conversation.append({"role": "assistant", "content": text})
+        return text, []
+
+    def add_tool_results(self, conversation, results):
+        for call, result in results:
+            conversation.append({"role": "tool", "tool_call_id": call.id, "content": result})
+
+# Esegue in parallelo tutte le chiamate a funzione di un turno; i risultati mantengono l'ordine delle chiamate
+def run_tool_calls(tool_calls, call_tool):
+    def run(call):
+        try:
+            result = call_tool(call.name, call.args)
+        except Exception as e:
+            return call, f"Errore durante l'esecuzione di {call.name}: {e}"
+        return call, result if result is not None else f"Funzione sconosciuta: {call.name}"
+    with ThreadPoolExecutor(max_workers=len(tool_calls)) as executor:
+        return list(executor.map(run, tool_calls))
+
+# Domanda all'LLM: call_tool(nome, argomenti) esegue le funzioni richieste dal modello.
+# Il modello può chiedere altre funzioni dopo averne visto i risultati, fino a max_rounds turni
+def ask(backend, user_prompt, call_tool, on_token=None, max_rounds=MAX_TOOL_ROUNDS):
+    conversation = backend.new_conversation(user_prompt)
+    for _ in range(max_rounds):
+        text, tool_calls = backend.complete(conversation, on_token)
+        if not tool_calls:
+            return text
+        backend.add_tool_results(conversation, run_tool_calls(tool_calls, call_tool))
+    # Limite raggiunto: il modello deve rispondere con i risultati ottenuti
+    text, _ = backend.complete(conversation, on_token, use_tools=False)
+    return text
@@ -0,0 +1,69 @@
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Dizionario LRU condiviso tra thread, opzionalmente copiato in una tabella SQLite (valori in JSON) per sopravvivere ai riavvii.
+# È la base comune della cache delle analisi di Stockfish e di quella delle risposte degli LLM
+class PersistentLRU:
+    def __init__(self, table, max_size, db_path=None):
+        self.table = table
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.db = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT)")
+            self.db.commit()
+
+    def get(self, key):
+        with self._lock:
+            value = self.entries.get(key)
+            if value is None and self.db is not None:
+                row = self.db.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._store(key, value)
+            if value is not None and not self.is_valid(value):
+                self._remove(key)
+                value = None
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+            if self.db is not None:
+                self.db.execute(f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+                self.db.commit()
+
+    # Le sottoclassi possono scartare i valori non più utilizzabili (es. scaduti)
+    def is_valid(self, value):
+        return True
+
+    def _store(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def _remove(self, key):
+        self.entries.pop(key, None)
+        if self.db is not None:
+            self.db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self.db.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / total, 3) if total else 0.0, "size": len(self.entries)}
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
@@ -1,25 +1,43 @@
-import io
-import json
 import os
-import shutil
+import queue
 import threading
+import time
 import tkinter as tk
 from tkinter import messagebox, scrolledtext
-import cairosvg
 import chess
-import chess.svg
 import cv2
-import google.generativeai as genai
-import google.ai.generativelanguage as glm 
 from PIL import Image, ImageTk
-from openai import OpenAI
 from stockfish import Stockfish
-from ultralytics import YOLO
 from dotenv import load_dotenv
-from recognize_position import extract_FEN, orient_chessboard
+from analysis import AnalysisWorker
+from archive import FrameArchive
+from board_renderer import BoardRenderer
+from detector import ChessPieceDetector
+from display import FrameDisplay
+from drift import CORRECTED, LOST
+from engine import MATE_SCORE, CachedEngine, EvaluationCache
+from engine_pool import EnginePool, STOCKFISH_PATH
+from fusion import SquareFusion
+from game_tracker import GameTracker, MOVED, REJECTED, RESYNC
+from metrics import METRICS, METRICS_FILE
+from llm_backends import FakeBackend, GeminiBackend, OpenAIBackend, ResponseCache, ask, load_system_prompt, response_key
+from motion import MotionWorker
+from pipeline import CaptureThread, InferenceWorker, LatestBuffer, RateCounter, crop_frame
+from recognize_position import board_geometry_from_detections
 
 GPT_MODEL = "gpt-4o"
 GEMINI_MODEL = "gemini-2.5-flash-preview-04-17"
+CAMERA_INDEX = 2 #webcam usata (variabile CAMERA_INDEX in keys.env per cambiarla)
+DISPLAY_INTERVAL_MS = 30 #frequenza di aggiornamento del video nella UI
+DETECTION_FPS = 10 #frequenza massima della detection continua (overlay)
+STOCKFISH_DEPTH = 15
+EVALUATION_CACHE_DB = "stockfish_cache.sqlite" #analisi salvate tra un avvio e l'altro (None per tenerle solo in memoria)
+RESPONSE_CACHE_DB = "assistant_cache.sqlite" #risposte dell'assistente salvate tra un avvio e l'altro (None per tenerle solo in memoria)
+RESPONSE_CACHE_TTL = 3600 #secondi dopo i quali una risposta salvata non viene più riutilizzata
+FUSION_FRAMES = 3 #frame consecutivi su cui deve essere stabile una casella prima di accettarne il cambiamento
+BOARD_SIZE = 600 #lato in pixel della scacchiera disegnata
+VIDEO_SIZE = (768, 576) #dimensione del video nella UI
+METRICS_INTERVAL = 5.0 #secondi tra due righe del file delle metriche (METRICS=1 in keys.env per attivarlo)
 PIECES = {
     "P": "il pedone bianco",
     "N": "il cavallo bianco",
@@ -39,17 +57,18 @@ TOOLS = [
     {
         "type": "function",
         "function": {
-            "name": "evaluate_move",
-            "description": "Valuta una mossa in notazione UCI usando Stockfish nella posizione corrente",
+            "name": "evaluate_moves",
+            "description": "Valuta con un'unica ricerca di Stockfish una o più mosse in notazione UCI nella posizione corrente e restituisce la classifica con la perdita di ogni mossa rispetto alla migliore tra quelle valutate",
             "parameters": {
                 "type": "object",
                 "properties": {
-                    "move_uci": {
-                        "type": "string",
-                        "description": "Mossa UCI da valutare (es: 'e2e4', 'g1f3')"
+                    "moves_uci": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Mosse UCI da valutare (es: ['e2e4', 'g1f3']), lista vuota per valutare tutte le mosse legali"
                     }
                 },
-                "required": ["move_uci"]
+                "required": ["moves_uci"]
             }
         }
     }
@@ -62,22 +81,57 @@ class ChessAssistantApp:
         self.root.attributes('-fullscreen', True)
         self.OPENAI_API_KEY = OPENAI_API_KEY
         self.GEMINI_API_KEY = GEMINI_API_KEY
-        self.chessboard = chess.Board()
-        self.old_fen = self.chessboard.board_fen()
-        self.turn = "w"
+        self.llm = self.create_llm_backend()
+        self.response_cache = ResponseCache(ttl=RESPONSE_CACHE_TTL, db_path=RESPONSE_CACHE_DB)
+        # Le domande vengono servite una alla volta da un unico thread: le risposte non si mescolano nella chat
+        self.questions = queue.Queue()
+        threading.Thread(target=self.answer_questions, daemon=True).start()
+        # Partita ricostruita dalle mosse legali riconosciute. La fusione accetta una nuova posizione al più sull'ultimo
+        # frame di un riconoscimento, quindi FUSION_FRAMES conferme richiedono che la confermi anche il riconoscimento successivo
+        self.tracker = GameTracker(resync_confirmations=FUSION_FRAMES)
+        self.confirmation_requested = False #riconoscimento di conferma già richiesto dopo l'ultimo assestamento
+        # Latenze per stadio: sempre registrate con METRICS=1, altrimenti solo mentre l'overlay è visibile
+        self.metrics_logging = os.getenv("METRICS") == "1"
+        METRICS.configure(self.metrics_logging, METRICS_FILE if self.metrics_logging else None)
+        self.last_metrics_write = time.monotonic()
         self.show_bounding_boxes = True
         self.automatic_detection = True
-        self.first_automatic_detection = True
+        self.fusion = SquareFusion(self.tracker.board.board_fen(), stable_frames=FUSION_FRAMES)
+        self.stockfish = self.initialize_stockfish()
+        self.evaluation_cache = EvaluationCache(db_path=EVALUATION_CACHE_DB)
+        self.engine = CachedEngine(self.stockfish, self.evaluation_cache, depth=STOCKFISH_DEPTH)
+        # Analisi continua della posizione corrente su un secondo processo Stockfish
+        self.analysis = AnalysisWorker(self.initialize_stockfish(), self.evaluation_cache, max_depth=STOCKFISH_DEPTH)
+        self.analysis.start()
+        self.analysis.set_position(self.tracker.board.fen())
+        self.engine_pool = None #pool di processi Stockfish per l'analisi della partita e le funzioni dell'assistente, creato al primo utilizzo
+        self.engine_pool_lock = threading.Lock()
+        self.board_renderer = BoardRenderer(BOARD_SIZE) #pezzi rasterizzati una volta, frame in cache per posizione
+        self.board_image = None
+        self.board_photo = None
         self.create_layout()
-        self.cap = cv2.VideoCapture(2)
+        self.cap = cv2.VideoCapture(int(os.getenv("CAMERA_INDEX", CAMERA_INDEX)))
         self.running = True
-        self.castling = "KQkq"
-        self.castle_blacklist = set()
-        self.photo_number = 1
-        self.stockfish = self.initialize_stockfish()
+        self.geometry = None #angoli e omografia della scacchiera, calcolati al riorientamento
+        self.detector = ChessPieceDetector() #pesi caricati una sola volta (variabile DETECTION_MODEL per cambiarli)
+        # Pipeline: thread di acquisizione -> worker di inferenza -> visualizzazione nel main loop di Tkinter
+        self.frames = LatestBuffer()
+        self.capture = CaptureThread(self.cap, self.frames, crop=crop_frame)
+        self.inference = InferenceWorker(self.detector, self.frames, max_fps=DETECTION_FPS, continuous=self.show_bounding_boxes)
+        # Il riconoscimento automatico parte solo quando la scacchiera si ferma dopo un movimento
+        self.motion = MotionWorker(self.frames, on_settled=self.on_board_settled)
+        self.display_stats = RateCounter()
+        self.last_display_seq = 0
+        # Archivio opzionale (ARCHIVE=1 in keys.env) dei frame e delle detection, scritto in un thread separato
+        self.archive = FrameArchive() if os.getenv("ARCHIVE") == "1" else None
+        self.capture.start()
+        self.inference.start()
+        self.motion.start()
+        if self.archive is not None:
+            self.archive.start()
         self.orient_board()
         self.update_webcam()
-        self.recognize_move_loop()
+        self.update_stats_label()
 
     def create_layout(self):
         # === FRAME SUPERIORE ===
@@ -87,8 +141,12 @@ class ChessAssistantApp:
         toolbar = tk.Frame(upper_frame, height=40, bg="#3c3c3c")
         toolbar.pack(side=tk.TOP, fill=tk.X)
         # Pulsante "Orienta correttamente"
-        orient_button = tk.Button(toolbar, text="Orienta correttamente", command=lambda: self.confirm("Riorientamento scacchiera", "Sei sicuro di voler riorientare la scacchiera?", "orienta"), font=("Helvetica", 12))
-        orient_button.pack(side=tk.LEFT, padx=(5, 10), pady=5)
+        self.orient_button = tk.Button(toolbar, text="Orienta correttamente", command=lambda: self.confirm("Riorientamento scacchiera", "Sei sicuro di voler riorientare la scacchiera?", "orienta"), font=("Helvetica", 12))
+        self.orient_button.pack(side=tk.LEFT, padx=(5, 10), pady=5)
+        self.orient_button_bg = self.orient_button.cget("bg") #il pulsante diventa rosso quando la deriva non è più correggibile
+        # Pulsante "Analizza partita"
+        analyse_button = tk.Button(toolbar, text="Analizza partita", command=self.analyse_game, font=("Helvetica", 12))
+        analyse_button.pack(side=tk.LEFT, padx=(0, 10), pady=5)
         # Checkbox per aggiungere o rimuovere le bounding boxes
         self.bounding_boxes_state = tk.BooleanVar()  # Variabile che memorizza lo stato della checkbox
         self.bounding_boxes_state.set(True)
@@ -99,6 +157,11 @@ class ChessAssistantApp:
         self.detection_state.set(True)
         checkbox = tk.Checkbutton(toolbar, text="Detection Automatica", variable=self.detection_state, command=self.toggle_detection, font=("Helvetica", 12), pady=6)
         checkbox.pack(side=tk.LEFT, padx=(0, 10), pady=5)
+        # Checkbox per l'overlay delle latenze
+        self.latency_state = tk.BooleanVar()
+        self.latency_state.set(False)
+        checkbox = tk.Checkbutton(toolbar, text="Latenze", variable=self.latency_state, command=self.toggle_latency_overlay, font=("Helvetica", 12), pady=6)
+        checkbox.pack(side=tk.LEFT, padx=(0, 10), pady=5)
         # Pulsante "Esci" con icona
         power_icon = Image.open(os.path.join("icons","power.png"))
         power_icon = power_icon.resize((45, 32), Image.LANCZOS)
@@ -117,6 +180,9 @@ class ChessAssistantApp:
         self.turn_button.bind("<Leave>", self.hide_tooltip)
         self.turn_button.pack(side=tk.RIGHT)
         self.update_turn_label()
+        # Label con gli FPS di acquisizione, detection e visualizzazione
+        self.stats_label = tk.Label(toolbar, text="", font=("Helvetica", 10), fg="white", bg="#3c3c3c")
+        self.stats_label.pack(side=tk.LEFT, padx=10)
         content_frame = tk.Frame(upper_frame)
         content_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
         # Pulsante "Forza detection" con icona
@@ -139,6 +205,9 @@ class ChessAssistantApp:
         # Webcam view (Sinistra)
         self.video_label = tk.Label(content_frame)
         self.video_label.pack(side=tk.LEFT, expand=True, fill=tk.BOTH)
+        self.video_display = FrameDisplay(self.video_label, VIDEO_SIZE) #buffer e PhotoImage riutilizzati ad ogni frame
+        # Overlay delle latenze sopra il video (nascosto finché la checkbox non è attiva)
+        self.latency_label = tk.Label(content_frame, text="", font=("Courier", 10), fg="#00ff00", bg="black", justify=tk.LEFT)
         # Legenda al centro
         legend_frame = tk.Frame(content_frame, width=200)
         legend_frame.pack(side=tk.LEFT, padx=10, pady=10, fill=tk.Y)
@@ -226,150 +295,222 @@ class ChessAssistantApp:
             tk.Button(button_frame, text="Si", width=10, command=lambda: [self.orient_board(), confirm_window.destroy()]).pack(side="left", padx=10)
         tk.Button(button_frame, text="No", width=10, command=confirm_window.destroy).pack(side="right", padx=10)
 
-    def count_moved_pieces(self, fen1, fen2):
-        board1 = chess.Board(fen1)
-        board2 = chess.Board(fen2)
-        moved_pieces = 0
-        for square in chess.SQUARES:
-            piece1 = board1.piece_at(square)
-            piece2 = board2.piece_at(square)
-            if piece1 != None and piece1 != piece2:
-                moved_pieces += 1
-        return moved_pieces
-
     def switch_turn(self):
-        self.turn = "w" if self.turn == "b" else "b"
+        self.tracker.switch_turn()
+        self.analysis.set_position(self.tracker.board.fen())
         self.update_turn_label()
+        self.update_board()
 
     def update_turn_label(self):
-        if self.turn == "w":
+        if self.tracker.board.turn == chess.WHITE:
             self.turn_label.config(text="Tocca al bianco")
         else:
             self.turn_label.config(text="Tocca al nero")
 
+    # Detection forzata: richiesta direttamente al worker di inferenza, il risultato viene elaborato in handle_detection
     def make_detection(self):
-        self.automatic_detection = True
-        self.recognize_move_loop(True)
-        self.automatic_detection = False
+        if self.running:
+            self.request_recognition("forzata")
 
-    def recognize_move_loop(self, only_one_detection=False):
-        if not self.running or not self.automatic_detection: 
-            return
+    # Chiamata dal thread del movimento quando la scacchiera si ferma
+    def on_board_settled(self):
+        self.confirmation_requested = False
+        self.request_recognition("automatica")
+
+    # Ogni riconoscimento usa FUSION_FRAMES frame consecutivi, fusi tra loro da SquareFusion
+    def request_recognition(self, tag):
+        for _ in range(FUSION_FRAMES):
+            self.inference.request_detection(tag)
+
+    # Ogni detection viene fusa con le precedenti, la posizione cambia solo quando le caselle modificate sono stabili
+    def recognize_move(self, detection):
         try:
-            self.turn = "w" if self.turn == "b" else "b"
-            img = os.path.join("game_photos", f"photo{str(self.photo_number+1)}.png")
-            txt = os.path.join("runs","detect",f"predict{str(self.photo_number+1)}","labels",f"photo{str(self.photo_number+1)}.txt")
-            self.make_photo(img)
-            model = YOLO("chesspiece-detection-model.pt")
-            model.predict(source=img, save=True, save_txt=True)
-            fen = extract_FEN(self.corners, img, txt)
-            #se la posizione non è cambiata, oppure se da un riconoscimento all'altro ci sono stati più di 2 pezzi mossi, 
-            #probabilmente significa che una mano sta passando sulla scacchiera nel momento della detection e sta coprendo molti pezzi
-            #devo mettere > 2 perchè durante l'arrocco 2 pezzi cambiano posizione e finiscono in 2 case vuote (idem per le catture)
-            #allo stesso tempo però per la detection forzata di una posizione (only_one_detection == True) potrei aver spostato volontariamente tanti pezzi
-            #e quindi in quel caso non devo farmi bloccare dal fatto che i pezzi spostati sono > 2. Inoltre se dopo aver forzato la detection della posizione,
-            #cambio nuovamente tanti pezzi attivando direttamente la detection automatica, questa detection non verrà accettata perchè magari ho modificato la posizione
-            #di più di 4 pezzi, per questo motivo se si tratta della prima detection automatica dopo la detection forzata devo ignorare il controllo sui pezzi mossi usando first_automatic_detection
-            if fen == self.old_fen or (self.count_moved_pieces(self.old_fen, fen) > 2 and not only_one_detection and not self.first_automatic_detection):
-                #ripristinare il turno cambiato all'inizio della funzione che va ripristinato a quello vecchio
-                self.turn = "w" if self.turn == "b" else "b"
-            else:
-                self.old_fen = fen
+            with METRICS.span("fusion"):
+                self.fusion.observe_detections(self.geometry, detection.detections, detection.frame.shape)
+            with METRICS.span("fusion_state"):
+                state = self.fusion.state()
+            # La posizione fusa viene spiegata con una mossa legale (o risincronizzata se nessuna mossa è compatibile)
+            # la detection forzata è una richiesta esplicita: la posizione viene adottata senza attendere conferme
+            with METRICS.span("tracking"):
+                outcome = self.tracker.update(state, force=detection.tag == "forzata")
+            # l'assestamento produce un solo riconoscimento: una posizione da confermare ne richiede un secondo
+            if outcome == REJECTED and detection.tag == "automatica" and not self.confirmation_requested:
+                self.confirmation_requested = True
+                self.request_recognition("automatica")
+            if outcome == RESYNC:
+                self.fusion.reset()
+            if outcome in (MOVED, RESYNC):
+                self.motion.refresh_drift_reference() #i pezzi sono cambiati: nuovo riferimento per la deriva
+                self.analysis.set_position(self.tracker.board.fen())
                 self.update_turn_label()
-                self.chessboard.set_fen(fen)
-                self.update_board()
-                if self.castling != "-":
-                    self.manage_castle_rights()
-            self.photo_number += 1
-            self.first_automatic_detection = False
+                # tempo dall'inizio dell'inferenza sul frame alla mossa riconosciuta
+                METRICS.record("frame_to_move", time.monotonic() - detection.timestamp)
+            self.update_board()
         except Exception as e:
             print(f"Errore durante il riconoscimento automatico: {e}")
-        finally:
-            if not only_one_detection:
-                self.root.after(4000, self.recognize_move_loop) #Richiama se stessa dopo 4 secondi
 
+    # Il riorientamento elabora sempre il frame intero: la scacchiera potrebbe essere uscita dalla regione precedente
     def orient_board(self):
-        img = os.path.join("game_photos",f"photo{str(self.photo_number)}.png")
-        txt = os.path.join("runs","detect","predict","labels",f"photo{str(self.photo_number)}.txt")
-        self.make_photo(img)
-        model = YOLO("modello.pt")
-        model.predict(source=img, save=True, save_txt=True, conf=0.25, name="", exist_ok=True)
-        self.corners = orient_chessboard(img, txt)
+        self.inference.request_detection("orienta", full_frame=True)
+
+    # Se l'orientamento non riesce (es. una torre manca o è coperta) resta in uso la geometria precedente
+    def orient_from_detection(self, detection):
+        try:
+            geometry = board_geometry_from_detections(detection.detections, detection.frame.shape)
+            if geometry is None:
+                raise ValueError("servono esattamente 4 torri, una per angolo")
+            roi = geometry.roi(detection.frame.shape)
+        except Exception as e:
+            print(f"Errore durante l'orientamento della scacchiera: {e}")
+            self.orient_button.config(bg="#c0392b")
+            messagebox.showwarning("Riorientamento scacchiera", "Impossibile orientare la scacchiera: le 4 torri devono essere visibili negli angoli.\nPosizionarle e premere \"Orienta correttamente\".")
+            return
+        self.geometry = geometry
+        self.motion.set_geometry(self.geometry)
+        self.inference.set_roi(roi)
+        self.orient_button.config(bg=self.orient_button_bg)
+
+    # Eventi del tracker della deriva: la geometria corretta sostituisce quella in uso (omografia e regione del detector),
+    # se la scacchiera è persa il riconoscimento automatico si ferma finché non viene riorientata o ritrovata
+    def handle_drift(self, event):
+        status, geometry, frame_shape = event
+        if status == CORRECTED:
+            self.geometry = geometry
+            self.inference.set_roi(geometry.roi(frame_shape))
+        elif status == LOST:
+            print("La scacchiera si è spostata troppo: premere \"Orienta correttamente\"")
+            self.orient_button.config(bg="#c0392b")
+        else:
+            self.orient_button.config(bg=self.orient_button_bg)
+
+    # Elabora nel thread di Tkinter le detection richieste esplicitamente (riorientamento e riconoscimento)
+    def handle_detection(self, detection):
+        if detection.error is not None:
+            if detection.tag == "orienta":
+                self.orient_button.config(bg="#c0392b")
+                messagebox.showwarning("Riorientamento scacchiera", f"Errore del detector durante l'orientamento: {detection.error}")
+            return
+        if detection.tag == "orienta":
+            self.orient_from_detection(detection)
+        elif detection.tag == "automatica" and not self.automatic_detection:
+            return
+        elif self.geometry is not None:
+            self.recognize_move(detection)
+        if self.archive is not None:
+            info = {"tag": detection.tag, "fen": self.tracker.board.fen()}
+            if self.geometry is not None:
+                info["corners"] = [[int(x), int(y)] for x, y in self.geometry.corners]
+            self.archive.submit(detection.frame, detection.detections, info, force=True)
 
     def toggle_bounding_boxes(self):
         if self.bounding_boxes_state.get():
             self.show_bounding_boxes = True
         else:
             self.show_bounding_boxes = False
+        self.inference.continuous = self.show_bounding_boxes
+
+    def toggle_latency_overlay(self):
+        if self.latency_state.get():
+            METRICS.enabled = True
+            self.latency_label.place(x=10, y=10)
+        else:
+            METRICS.enabled = self.metrics_logging
+            self.latency_label.place_forget()
 
     def toggle_detection(self):
         if self.detection_state.get():
             self.automatic_detection = True
             self.instant_detection_button.config(state=tk.DISABLED)
-            self.first_automatic_detection = True
-            self.recognize_move_loop()
+            self.motion.invalidate()
+            self.motion.enabled = True
         else:
             self.automatic_detection = False
+            self.motion.enabled = False
             self.instant_detection_button.config(state=tk.NORMAL)
-            self.first_automatic_detection = False
-
-    def make_photo(self, img_name):
-        ret, frame = self.cap.read() 
-        if not ret:
-            print("Impossible to read the webcam")
-            return
-        original_height = frame.shape[0]
-        original_width = frame.shape[1]
-        taglio_alto = int(original_height * 0.25)  # elimina 25% della foto dall'alto
-        taglio_destro = int(original_width * 0.13)  # 13% della foto da destra
-        frame_cropped = frame[taglio_alto:, :original_width - taglio_destro]
-        cv2.imwrite(img_name, frame_cropped)
 
     def initialize_stockfish(self):
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        stockfish_path = os.path.join(base_dir, "Stockfish", "src", "stockfish")
-        stockfish = Stockfish(stockfish_path, depth=15)
+        stockfish = Stockfish(STOCKFISH_PATH, depth=STOCKFISH_DEPTH)
         stockfish.set_skill_level(20)
         return stockfish
 
-    def get_stockfish_moves(self, number):
+    # Restituisce (profondità, mosse): se disponibile usa subito il risultato dell'analisi in background.
+    # Senza fen viene analizzata la posizione attuale della partita
+    def top_moves(self, number, fen=None):
+        fen = fen or self.tracker.board.fen()
+        latest = self.analysis.latest(fen) if number == self.analysis.multipv else None
+        if latest is not None:
+            return latest
+        with METRICS.span("stockfish"):
+            return STOCKFISH_DEPTH, self.engine.top_moves(fen, number)
+
+    def get_stockfish_moves(self, number, fen=None):
+        return self.describe_moves(self.top_moves(number, fen)[1], chess.Board(fen) if fen else None)
+
+    def describe_moves(self, moves, board=None):
         best_moves = []
-        fen_position = self.chessboard.board_fen()
-        full_fen = f"{fen_position} {self.turn} {self.castling} - 0 1"
-        self.stockfish.set_fen_position(full_fen)
-        for move in self.stockfish.get_top_moves(number):
+        for move in moves:
             if move["Mate"] is None:
-                best_moves.append(f"{self.uci_to_text(move["Move"])}: Valutazione = {move["Centipawn"]/100}")
+                best_moves.append(f"{self.uci_to_text(move["Move"], board)}: Valutazione = {move["Centipawn"]/100}")
             else:
-                best_moves.append(f"{self.uci_to_text(move["Move"])}: Matto in {abs(move["Mate"])} mosse")
+                best_moves.append(f"{self.uci_to_text(move["Move"], board)}: Matto in {abs(move["Mate"])} mosse")
         return best_moves
     
-    def evaluate_move(self, move_uci):
-        move = chess.Move.from_uci(move_uci)
-        fen_position = self.chessboard.board_fen()
-        full_fen = f"{fen_position} {self.turn} {self.castling} - 0 1"
-        chessboard_copy = chess.Board(fen=full_fen)
-        if move in chessboard_copy.legal_moves:
-            chessboard_copy.push(move)
-            fen_position = chessboard_copy.board_fen()
-            turn = "w" if self.turn == "b" else "b"
-            full_fen = f"{fen_position} {turn} {self.castling} - 0 1"
-            self.stockfish.set_fen_position(full_fen)
-            dict_evalutation = self.stockfish.get_evaluation()
-            if dict_evalutation.get("type") == "cp":
-                return f"Valutazione: {dict_evalutation['value']/100}"
-            elif dict_evalutation.get("type") == "mate":
-                return f"Matto in {abs(dict_evalutation['value'])} mosse"
-        else:
-            return "Mossa illegale nella posizione corrente"
+    # Valuta più mosse in un'unica ricerca di Stockfish e restituisce la classifica in formato testuale.
+    # Usa il pool di motori, così le chiamate dell'assistente nello stesso turno vengono eseguite in parallelo
+    def evaluate_moves(self, fen, moves_uci):
+        with METRICS.span("stockfish"):
+            result = self.get_engine_pool().evaluate_moves(fen, moves_uci)
+        lines = []
+        for rank, move in enumerate(result["moves"], start=1):
+            if move["Mate"] is None:
+                evaluation = f"Valutazione: {move['Centipawn']/100}"
+            else:
+                evaluation = f"Matto in {abs(move['Mate'])} mosse"
+            lines.append(f"{rank}. {move['Move']}: {evaluation}, perdita rispetto alla migliore: {move['CentipawnLoss']/100}")
+        for move_uci in result["illegal"]:
+            lines.append(f"{move_uci}: Mossa illegale nella posizione corrente")
+        return "\n".join(lines)
+
+    # Esegue la funzione richiesta da un LLM sulla posizione della domanda (fen), None se la funzione non esiste
+    def call_tool(self, fen, func_name, args):
+        if func_name == "evaluate_moves":
+            return self.evaluate_moves(fen, list(args.get("moves_uci") or []))
+        return None
 
     def stockfish_suggestions(self):
-        best_moves = self.get_stockfish_moves(5)
-        response = "Le 5 mosse migliori di stockfish sono:\n"
+        depth, moves = self.top_moves(5)
+        best_moves = self.describe_moves(moves)
+        response = f"Le 5 mosse migliori di stockfish (profondità {depth}) sono:\n"
         for move in best_moves:
             response += f"{move}\n"
         self.add_message("Assistente", response)
 
+    # Analisi di tutte le posizioni della partita in parallelo su un pool di processi Stockfish
+    def analyse_game(self):
+        positions = list(self.tracker.history)
+        moves = list(self.tracker.history_moves)
+        if len(positions) < 2:
+            self.add_message("Assistente", "Non ci sono ancora mosse da analizzare")
+            return
+        self.add_message("Assistente", f"Analisi di {len(positions) - 1} mosse in corso...")
+        threading.Thread(target=self.run_game_analysis, args=(positions, moves), daemon=True).start()
+
+    def get_engine_pool(self):
+        with self.engine_pool_lock:
+            if self.engine_pool is None:
+                self.engine_pool = EnginePool(STOCKFISH_PATH, depth=STOCKFISH_DEPTH, cache=self.evaluation_cache)
+            return self.engine_pool
+
+    def run_game_analysis(self, positions, moves):
+        analysis, stats = self.get_engine_pool().analyse_game(positions, moves)
+        response = f"Analisi completata ({stats['positions']} posizioni in {stats['seconds']} s, {stats['positions_per_second']} posizioni/s)\n"
+        for entry in analysis:
+            if entry["blunder"]:
+                response += f"Errore grave alla semimossa {entry['ply']} ({entry['move']}): perdita di {entry['cp_loss']/100} pedoni, valutazione = {entry['evaluation']}\n"
+        if not any(entry["blunder"] for entry in analysis):
+            response += "Nessun errore grave trovato\n"
+        self.root.after(0, lambda: self.add_message("Assistente", response))
+
     def get_all_widgets(self, parent):
         widgets = parent.winfo_children()
         for widget in widgets:
@@ -387,20 +528,45 @@ class ChessAssistantApp:
         user_text = self.user_input.get()
         if user_text.strip() == "":
             return
-        self.add_message("Utente", user_text)
         self.user_input.delete(0, tk.END)
         self.set_cursor("watch")
         self.root.update_idletasks()
-        # Avvia un thread per non bloccare l'interfaccia
-        threading.Thread(target=self.process_user_input, args=(user_text,), daemon=True).start()
-
-    def process_user_input(self, user_text):
-        if self.OPENAI_API_KEY:
-            response = self.ask_chatGPT(user_text)
-        elif self.GEMINI_API_KEY:
-            response = self.ask_gemini(user_text)
-        self.root.after(0, lambda: self.add_message("Assistente", response))
-        self.root.after(0, lambda: self.set_cursor(""))
+        # La posizione viene letta qui, sul thread di Tk: prompt, funzioni e cache della risposta usano tutti la stessa,
+        # anche se nel frattempo il riconoscimento registra una nuova mossa
+        fen = self.tracker.board.fen()
+        # La risposta viene elaborata in un thread per non bloccare l'interfaccia
+        self.questions.put((user_text, fen))
+
+    def answer_questions(self):
+        while True:
+            user_text, fen = self.questions.get()
+            self.process_user_input(user_text, fen)
+            if self.questions.empty():
+                self.root.after(0, lambda: self.set_cursor(""))
+
+    # La domanda compare nella chat quando tocca a lei e la risposta viene mostrata token per token, man mano che arriva.
+    # Una domanda già fatta sulla stessa posizione viene servita dalla cache senza interrogare LLM e Stockfish:
+    # viene salvato esattamente il testo mostrato, compreso quello scritto dal modello prima delle chiamate a funzione
+    def process_user_input(self, user_text, fen):
+        self.root.after(0, self.add_message, "Utente", user_text)
+        self.root.after(0, self.start_assistant_message)
+        key = response_key(fen, user_text, self.llm)
+        try:
+            response = self.response_cache.get(key)
+            if response is not None:
+                self.root.after(0, self.append_assistant_text, response)
+            else:
+                shown = []
+                def on_token(token):
+                    shown.append(token)
+                    self.root.after(0, self.append_assistant_text, token)
+                start = time.perf_counter()
+                with METRICS.span("llm"):
+                    ask(self.llm, self.build_user_prompt(user_text, fen), lambda name, args: self.call_tool(fen, name, args), on_token=on_token)
+                self.response_cache.put(key, "".join(shown), time.perf_counter() - start)
+        except Exception as e:
+            self.root.after(0, self.append_assistant_text, f"Errore durante la richiesta all'assistente: {e}")
+        self.root.after(0, self.append_assistant_text, "\n")
 
     def add_message(self, sender, message):
         self.chat_area.configure(state='normal')
@@ -415,258 +581,177 @@ class ChessAssistantApp:
         self.chat_area.configure(state='disabled')
         self.chat_area.yview(tk.END)
 
-    def read_prompt(self, prompt_filename):
-        filename = prompt_filename
-        with open(filename, 'r', encoding='utf-8') as file:
-            content = file.read()
-        return content
-    
-    def ask_chatGPT(self, user_prompt):
-        system_prompt = self.read_prompt("prompt_system.txt") #INFORMAZIONI DI CONTESTO DA DARE A CHATGPT (ad esempio sei un esperto di scacchi)
-        client = OpenAI(api_key=self.OPENAI_API_KEY)
-        stockfish_moves = self.get_stockfish_moves(5)
-        color_turn = "white" if self.turn == "w" else "black"
-        full_user_prompt = f"{user_prompt}\nToccal al {color_turn} e le mosse consigliate da stockfish con le rispettive valutazioni sono all'interno di questa lista: {stockfish_moves}"
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "evaluate_move",
-                    "description": "Valuta una mossa in notazione UCI usando Stockfish nella posizione corrente",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "move_uci": {
-                                "type": "string",
-                                "description": "Mossa UCI da valutare (es: 'e2e4', 'g1f3')"
-                            }
-                        },
-                        "required": ["move_uci"]
-                    }
-                }
-            }
-        ]
-        completion = client.chat.completions.create(
-            model = GPT_MODEL,
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": full_user_prompt}
-            ],
-            tools = tools,
-            tool_choice = "auto",
-            temperature=0.0
-        )
-        message = completion.choices[0].message
-        if message.tool_calls:
-            final_messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": full_user_prompt},
-                message
-            ]
-            for call in message.tool_calls:
-                func_name = call.function.name
-                args = json.loads(call.function.arguments)
-                if func_name == "evaluate_move":
-                    func_result = self.evaluate_move(args["move_uci"])
-                    final_messages.append({
-                        "role": "tool",
-                        "tool_call_id": call.id,
-                        "name": func_name,
-                        "content": func_result
-                    })
-            # Seconda richiesta: GPT riceve l'output della funzione
-            followup = client.chat.completions.create(
-                model=GPT_MODEL,
-                messages=final_messages,
-                temperature=0.0
-            )
-            return followup.choices[0].message.content
-        # Altrimenti risponde direttamente
-        return message.content.replace("\n", "")
-        
-    def uci_to_text(self, move_uci):
+    def start_assistant_message(self):
+        self.chat_area.configure(state='normal')
+        self.chat_area.insert(tk.END, "Assistente: ", "sender_label")  # in rosso
+        self.chat_area.configure(state='disabled')
+
+    def append_assistant_text(self, text):
+        self.chat_area.configure(state='normal')
+        self.chat_area.insert(tk.END, text, "assistant")    # in viola
+        self.chat_area.configure(state='disabled')
+        self.chat_area.yview(tk.END)
+
+    # Backend LLM creato una sola volta all'avvio (LLM_BACKEND=fake per usare il backend locale senza rete)
+    def create_llm_backend(self):
+        system_prompt = load_system_prompt("prompt_system.txt") #INFORMAZIONI DI CONTESTO DA DARE ALL'LLM (ad esempio sei un esperto di scacchi)
+        if os.getenv("LLM_BACKEND") == "fake":
+            return FakeBackend(token_delay=0.05)
+        if self.OPENAI_API_KEY:
+            return OpenAIBackend(self.OPENAI_API_KEY, GPT_MODEL, system_prompt, TOOLS)
+        return GeminiBackend(self.GEMINI_API_KEY, GEMINI_MODEL, system_prompt, TOOLS)
+
+    def build_user_prompt(self, user_prompt, fen):
+        stockfish_moves = self.get_stockfish_moves(5, fen)
+        color_turn = "white" if chess.Board(fen).turn == chess.WHITE else "black"
+        return f"{user_prompt}\nTocca al {color_turn} e le mosse consigliate da stockfish con le rispettive valutazioni sono all'interno di questa lista: {stockfish_moves}"
+
+    # board: posizione in cui si trova la mossa (di default quella attuale della partita)
+    def uci_to_text(self, move_uci, board=None):
         square1 = move_uci[:2]
         square2 = move_uci[2:4]
-        if self.square_to_piece(square2) != "casella":
-            return f"Muovere {self.square_to_piece(square1)} che si trova in {square1} spostandolo/a in {square2} catturando {self.square_to_piece(square2)}"
-        elif self.is_castle(square1, square2):
-            return f"Muovere {self.square_to_piece(square1)} che si trova in {square1} spostandolo/a in {square2} facendo l'arrocco {self.castle_type}"
-        return f"Muovere {self.square_to_piece(square1)} che si trova in {square1} spostandolo/a in {square2}"
+        if self.square_to_piece(square2, board) != "casella":
+            return f"Muovere {self.square_to_piece(square1, board)} che si trova in {square1} spostandolo/a in {square2} catturando {self.square_to_piece(square2, board)}"
+        elif self.is_castle(square1, square2, board):
+            return f"Muovere {self.square_to_piece(square1, board)} che si trova in {square1} spostandolo/a in {square2} facendo l'arrocco {self.castle_type}"
+        return f"Muovere {self.square_to_piece(square1, board)} che si trova in {square1} spostandolo/a in {square2}"
     
-    def ask_gemini(self, user_prompt):
-        genai.configure(api_key=self.GEMINI_API_KEY)
-        stockfish_moves = self.get_stockfish_moves(5)
-        color_turn = "white" if self.turn == "w" else "black"
-        system_prompt = self.read_prompt("prompt_system.txt") 
-        full_user_prompt = f"{system_prompt}\n\n{user_prompt}\nTocca al {color_turn} e le mosse consigliate da Stockfish sono: {stockfish_moves}"
-        gemini = genai.GenerativeModel(
-            model_name=GEMINI_MODEL,
-            system_instruction=system_prompt,
-            generation_config=genai.types.GenerationConfig(temperature=0.0)
-        )
-        evaluate_move_tool = genai.types.FunctionDeclaration(
-            name="evaluate_move",
-            description="Valuta una mossa in notazione UCI usando Stockfish nella posizione corrente",
-            parameters={
-                "type": "object",
-                "properties": {
-                    "move_uci": {
-                        "type": "string",
-                        "description": "Mossa UCI da valutare (es: 'e2e4', 'g1f3')"
-                    }
-                },
-                "required": ["move_uci"]
-            }
-        )
-        tools_list = [genai.types.Tool(function_declarations=[evaluate_move_tool])]
-        # Inizio della cronologia della conversazione per Gemini
-        # Il system_prompt è gestito a livello di modello.
-        # Il primo messaggio è quello dell'utente.
-        current_conversation_history = [
-            glm.Content(role="user", parts=[glm.Part(text=full_user_prompt)])
-        ]
-        # Prima richiesta a Gemini
-        response = gemini.generate_content(
-            current_conversation_history,
-            tools=tools_list
-        )
-        # Estrai la prima parte candidata della risposta
-        candidate = response.candidates[0]
-        message_part = candidate.content.parts[0] if candidate.content and candidate.content.parts else None
-        if message_part and message_part.function_call:
-            current_conversation_history.append(candidate.content)
-            function_call = message_part.function_call
-            func_name = function_call.name
-            args = dict(function_call.args)
-            if func_name == "evaluate_move":
-                move_to_evaluate = args.get("move_uci")
-                function_result_text = self.evaluate_move(move_to_evaluate)
-                tool_response_part = glm.Part(
-                    function_response=glm.FunctionResponse(
-                        name=func_name,
-                        response={"result": function_result_text}
-                    )
-                )
-                current_conversation_history.append(glm.Content(role="function", parts=[tool_response_part]))
-                # Seconda richiesta a Gemini con il risultato della funzione
-                followup_response = gemini.generate_content(
-                    current_conversation_history,
-                    tools=tools_list
-                )
-                return followup_response.text.replace("\n", "")
-            else:
-                return f"Gemini: Richiesta chiamata a funzione sconosciuta: {func_name}"
-        else:
-            # Nessuna chiamata di funzione, il modello ha risposto direttamente, response.text dovrebbe contenere la risposta diretta
-            return response.text.replace("\n", "")
-        
-    def square_to_piece(self, square):
+    def square_to_piece(self, square, board=None):
         square = chess.parse_square(square)
-        piece = self.chessboard.piece_at(square)
+        piece = (board or self.tracker.board).piece_at(square)
         if piece:
             return PIECES[piece.symbol()]
         else:
             return "casella"
                 
-    def is_castle(self, square1, square2):
-        if self.square_to_piece(square1) == PIECES["K"] and square1 == "e1" and (square2 == "g1" or square2 == "c1"):
+    def is_castle(self, square1, square2, board=None):
+        if self.square_to_piece(square1, board) == PIECES["K"] and square1 == "e1" and (square2 == "g1" or square2 == "c1"):
             self.castle_type = "corto" if square2 == "g1" else "lungo"
             return True
-        if self.square_to_piece(square1) == PIECES["k"] and square1 == "e8" and (square2 == "g8" or square2 == "c8"):
+        if self.square_to_piece(square1, board) == PIECES["k"] and square1 == "e8" and (square2 == "g8" or square2 == "c8"):
             self.castle_type = "corto" if square2 == "g8" else "lungo"
             return True       
         return False
 
-    #Controllare la posizione delle torri e dei re nella posizione rilevata per poter ottenere i diritti d'arrocco della posizione
-    def manage_castle_rights(self):
-        e1_piece = self.square_to_piece("e1")
-        a1_piece = self.square_to_piece("a1")
-        h1_piece = self.square_to_piece("h1")
-        e8_piece = self.square_to_piece("e8")
-        a8_piece = self.square_to_piece("a8")
-        h8_piece = self.square_to_piece("h8")
-        self.castling = ""
-        valid_castle_conditions = [
-            ("re bianco" in e1_piece and "torre bianca" in h1_piece, "K"),
-            ("re bianco" in e1_piece and "torre bianca" in a1_piece, "Q"),
-            ("re nero" in e8_piece and "torre nera" in h8_piece, "k"),
-            ("re nero" in e8_piece and "torre nera" in a8_piece, "q"),
-        ]
-        for condition, letter in valid_castle_conditions:
-            if condition and (letter not in self.castle_blacklist):
-                self.castling += letter
-            else:
-                self.castle_blacklist.add(letter)
-        if self.castling == "":
-            self.castling = "-"
-
     def update_webcam(self):
         if not self.running:
             return
-        ret, frame = self.cap.read()
-        if ret:
-            # Ritaglio (uguale a make_photo)
-            original_height = frame.shape[0]
-            original_width = frame.shape[1]
-            taglio_alto = int(original_height * 0.3)
-            taglio_destro = int(original_width * 0.13)
-            frame_cropped = frame[taglio_alto:, :original_width - taglio_destro]
-            # YOLOv8 prediction in real-time
-            model = YOLO("modello.pt")
-            results = model.predict(source=frame_cropped, conf=0.25, save=False, stream=True)
+        # un errore su una singola detection non deve interrompere il ciclo del video (che si riprogramma in fondo)
+        while True:
+            try:
+                detection = self.inference.detections.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                self.handle_detection(detection)
+            except Exception as e:
+                print(f"Errore durante l'elaborazione della detection ({detection.tag}): {e}")
+        while True:
+            try:
+                event = self.motion.drift_events.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                self.handle_drift(event)
+            except Exception as e:
+                print(f"Errore durante la correzione della deriva: {e}")
+        frame_seq, frame = self.frames.latest()
+        if frame is not None and frame_seq != self.last_display_seq:
+            self.display_stats.tick(dropped=max(0, frame_seq - self.last_display_seq - 1))
+            self.last_display_seq = frame_seq
+            # Visualizzazione: le bounding box dell'ultima detection vengono disegnate sul frame più recente
+            detections = roi = None
             if self.show_bounding_boxes:
-                for r in results:
-                    annotated_frame = r.plot() #Disegna bounding box
-            else:
-                annotated_frame = frame_cropped #Mostra solo il frame originale ritagliato
-            # Visualizzazione
-            cv2image = cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(cv2image).resize((768, 576), Image.LANCZOS)
-            imgtk = ImageTk.PhotoImage(image=img)
-            self.video_label.imgtk = imgtk
-            self.video_label.configure(image=imgtk)
-        self.root.after(30, self.update_webcam) #programmare una chiamata futura alla funzione self.update_webcam dopo 30 millisecondi, all'interno del ciclo principale di Tkinter (mainloop).
+                _, result = self.inference.results.latest()
+                if result is not None:
+                    detections, roi = result.detections, result.roi
+            with METRICS.span("video_render"):
+                self.video_display.show(frame, detections, roi)
+            if self.archive is not None:
+                self.archive.submit(frame, detections) #campionato, al massimo un frame ogni SAMPLE_INTERVAL secondi
+        self.root.after(DISPLAY_INTERVAL_MS, self.update_webcam) #programmare una chiamata futura alla funzione self.update_webcam dopo 30 millisecondi, all'interno del ciclo principale di Tkinter (mainloop).
+
+    def pipeline_stats(self):
+        drift = self.motion.drift #letto una volta sola: il thread del movimento può sostituirlo
+        return {
+            "capture": self.capture.stats.snapshot(),
+            "detection": self.inference.stats.snapshot(),
+            "display": self.display_stats.snapshot(),
+            "stockfish_cache": self.evaluation_cache.stats(),
+            "assistant_cache": self.response_cache.stats(),
+            "archive": self.archive.stats() if self.archive is not None else None,
+            "drift": drift.stats() if drift is not None else None,
+        }
 
+    def update_stats_label(self):
+        if not self.running:
+            return
+        stats = self.pipeline_stats()
+        self.update_board() #barra della valutazione aggiornata con l'analisi in background
+        self.stats_label.config(text=f"Video {stats['display']['fps']} fps | Detection {stats['detection']['fps']} fps | Frame scartati {stats['display']['dropped']} | Cache Stockfish {stats['stockfish_cache']['hits']}/{stats['stockfish_cache']['hits'] + stats['stockfish_cache']['misses']} | Cache assistente {stats['assistant_cache']['hits']}/{stats['assistant_cache']['hits'] + stats['assistant_cache']['misses']} ({stats['assistant_cache']['saved_seconds']} s risparmiati)")
+        if self.latency_state.get():
+            self.latency_label.config(text=METRICS.overlay_text())
+        if time.monotonic() - self.last_metrics_write >= METRICS_INTERVAL:
+            METRICS.write()
+            self.last_metrics_write = time.monotonic()
+        self.root.after(1000, self.update_stats_label)
+
+    # Valutazione della posizione corrente (centipedoni dal punto di vista del bianco) dall'analisi in background
+    def current_evaluation(self):
+        latest = self.analysis.latest(self.tracker.board.fen())
+        if not latest or not latest[1]:
+            return None
+        best = latest[1][0]
+        if best["Mate"] is not None:
+            return MATE_SCORE if best["Mate"] > 0 else -MATE_SCORE
+        return best["Centipawn"]
+
+    # La PhotoImage della scacchiera è unica e viene aggiornata solo quando il frame cambia
     def update_board(self):
-        svg_data = chess.svg.board(board=self.chessboard)
-        png_data = cairosvg.svg2png(bytestring=svg_data)
-        image = Image.open(io.BytesIO(png_data))
-        image = image.resize((600, 600))
-        tk_img = ImageTk.PhotoImage(image=image)
-        self.chess_canvas.imgtk = tk_img
-        self.chess_canvas.configure(image=tk_img)
+        board = self.tracker.board
+        lastmove = board.peek() if board.move_stack else None
+        # Le caselle riconosciute con poca confidenza vengono evidenziate
+        uncertain = {chess.parse_square(square) for square in self.fusion.uncertain_squares()}
+        with METRICS.span("board_render"):
+            image = self.board_renderer.render(board, lastmove, uncertain, self.current_evaluation())
+        if image is self.board_image:
+            return
+        self.board_image = image
+        if self.board_photo is None:
+            self.board_photo = ImageTk.PhotoImage(image=image)
+            self.chess_canvas.configure(image=self.board_photo)
+        else:
+            self.board_photo.paste(image)
 
     def stop(self):
         self.running = False
+        self.capture.stop()
+        self.inference.stop()
+        self.motion.stop()
+        if self.archive is not None:
+            self.archive.stop()
+        self.analysis.stop()
+        if self.engine_pool is not None:
+            self.engine_pool.close()
+        self.capture.join(timeout=1)
+        self.inference.join(timeout=1)
+        self.motion.join(timeout=1)
+        if self.archive is not None:
+            self.archive.join(timeout=2)
         self.cap.release()
         self.root.destroy()
 
 
-def remove_files_in_folder(folder_path):
-    if os.path.exists(folder_path):
-        for filename in os.listdir(folder_path):
-            full_path = os.path.join(folder_path, filename)
-            if os.path.isfile(full_path):
-                os.remove(full_path)
-    else:
-        os.makedirs(folder_path)
-
-def remove_folder(folder_path):
-    if os.path.exists(folder_path):
-        shutil.rmtree(folder_path)
-
 if __name__ == "__main__":
     load_dotenv(dotenv_path="keys.env")
     openai_api_key = os.getenv("OPENAI_API_KEY")
     gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not openai_api_key and not gemini_api_key:
+    if not openai_api_key and not gemini_api_key and os.getenv("LLM_BACKEND") != "fake":
         raise EnvironmentError("Devi impostare almeno una tra OPENAI_API_KEY e GEMINI_API_KEY nel file keys.env, nel caso in cui siano presenti entrambe la priorità sarà data a OPENAI_API_KEY")
-    remove_files_in_folder("game_photos")
-    remove_folder("runs")
     root = tk.Tk()
     if openai_api_key:
         app = ChessAssistantApp(root, openai_api_key, None)
-    elif gemini_api_key:
+    else:
         app = ChessAssistantApp(root, None, gemini_api_key)
     root.protocol("WM_DELETE_WINDOW", app.stop)
     root.mainloop()
\ No newline at end of file
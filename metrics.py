@@ -0,0 +1,103 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+import numpy as np
+
+METRICS_FILE = "metrics.jsonl"
+METRICS_MAX_BYTES = 5 * 1024 * 1024 #dimensione oltre la quale il file delle metriche viene ruotato
+METRICS_BACKUPS = 3
+
+# Latenze degli ultimi window campioni di uno stadio, in millisecondi
+class LatencyHistogram:
+    def __init__(self, window=500):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, milliseconds):
+        self.samples.append(milliseconds)
+        self.count += 1
+
+    def percentiles(self):
+        p50, p95, p99 = np.percentile(np.fromiter(self.samples, dtype=np.float64), [50, 95, 99])
+        return {"count": self.count, "p50": round(p50, 2), "p95": round(p95, 2), "p99": round(p99, 2)}
+
+# Intervallo di tempo misurato con "with", registrato alla chiusura
+class Span:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+# Span che non misura nulla, restituito quando la strumentazione è disattivata
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = NullSpan()
+
+# Latenze per stadio (acquisizione, inferenza, omografia, FEN, Stockfish, LLM, disegno...):
+# ogni stadio ha un istogramma mobile e i percentili vengono scritti periodicamente su un file JSONL a rotazione
+class Metrics:
+    def __init__(self, window=500):
+        self.enabled = False
+        self.window = window
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._logger = None
+
+    def configure(self, enabled, path=None, max_bytes=METRICS_MAX_BYTES, backups=METRICS_BACKUPS):
+        self.enabled = enabled
+        if path and self._logger is None:
+            self._logger = logging.getLogger("chess_assistant.metrics")
+            self._logger.propagate = False
+            self._logger.setLevel(logging.INFO)
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+
+    def span(self, name):
+        return Span(self, name) if self.enabled else NULL_SPAN
+
+    def record(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram(self.window)
+            histogram.add(seconds * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: histogram.percentiles() for name, histogram in self.histograms.items()}
+
+    # Aggiunge al file delle metriche una riga con i percentili correnti di tutti gli stadi
+    def write(self):
+        if not self.enabled or self._logger is None:
+            return
+        stages = self.snapshot()
+        if stages:
+            self._logger.info(json.dumps({"time": round(time.time(), 3), "stages": stages}))
+
+    # Testo per l'overlay: una riga per stadio con p50/p95/p99 in millisecondi
+    def overlay_text(self):
+        lines = []
+        for name, stats in sorted(self.snapshot().items()):
+            lines.append(f"{name:<14} {stats['p50']:>8.1f} {stats['p95']:>8.1f} {stats['p99']:>8.1f}")
+        return "\n".join([f"{'ms':<14} {'p50':>8} {'p95':>8} {'p99':>8}"] + lines) if lines else ""
+
+# Istanza condivisa da tutti i moduli, configurata all'avvio dell'applicazione
+METRICS = Metrics()
@@ -0,0 +1,164 @@
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+from drift import CORRECTED, LOST, DriftTracker
+
+# Rilevatore di cambiamenti sulla scacchiera rettificata (a bassa risoluzione, in scala di grigi).
+# Segnala quando avviare il riconoscimento: solo dopo che la scacchiera si è fermata in seguito ad un movimento,
+# e mai mentre una mano è sopra la scacchiera
+class MotionGate:
+    def __init__(self, geometry, size=96, diff_threshold=12.0, settle_frames=5, hand_squares=6, hand_timeout=3.0):
+        self.size = size - size % 8
+        self.cell = self.size // 8
+        self.diff_threshold = diff_threshold #differenza media di grigio oltre la quale una casella è cambiata
+        self.settle_frames = settle_frames #frame consecutivi senza movimento per considerare la scacchiera ferma
+        self.hand_squares = hand_squares #oltre questo numero di caselle cambiate probabilmente c'è una mano ferma sulla scacchiera
+        self.hand_timeout = hand_timeout #dopo questo tempo da fermi si accetta comunque il cambiamento (es. posizione risistemata)
+        self.set_homography(geometry)
+        self.reference = None
+        self.still_frames = 0
+        self.still_since = None
+        self.pending = True
+
+    def set_homography(self, geometry):
+        scale = np.diag([self.size / geometry.output_size[0], self.size / geometry.output_size[1], 1.0])
+        self.H = scale @ geometry.H
+        self.previous = None
+
+    # Geometria corretta dal tracker della deriva: le viste precedenti non sono più confrontabili,
+    # ma senza una nuova mossa non serve un nuovo riconoscimento
+    def update_geometry(self, geometry):
+        self.set_homography(geometry)
+        self.reference = None
+
+    # Vista dall'alto della scacchiera, ridotta e in scala di grigi
+    def rectify(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.warpPerspective(gray, self.H, (self.size, self.size), flags=cv2.INTER_LINEAR)
+
+    # Differenza media per casella (matrice 8x8) tra due viste rettificate
+    def square_differences(self, a, b):
+        diff = cv2.absdiff(a, b).astype(np.float32)
+        return diff.reshape(8, self.cell, 8, self.cell).mean(axis=(1, 3))
+
+    def changed_squares(self, a, b):
+        return int(np.count_nonzero(self.square_differences(a, b) > self.diff_threshold))
+
+    # Forza un nuovo riconoscimento appena la scacchiera è ferma
+    def invalidate(self):
+        self.reference = None
+        self.pending = True
+
+    # Elabora un frame, restituisce True quando il riconoscimento deve partire.
+    # now: istante del frame in secondi (es. la posizione nel video), di default l'orologio del sistema
+    def update(self, frame, now=None):
+        now = time.monotonic() if now is None else now
+        current = self.rectify(frame)
+        previous = self.previous
+        self.previous = current
+        if previous is None:
+            return False
+        if self.changed_squares(current, previous) > 0:
+            self.still_frames = 0
+            self.still_since = None
+            self.pending = True
+            return False
+        self.still_frames += 1
+        if self.still_since is None:
+            self.still_since = now
+        if not self.pending or self.still_frames < self.settle_frames:
+            return False
+        if self.reference is not None:
+            changed = self.changed_squares(current, self.reference)
+            if changed == 0:
+                self.pending = False
+                return False
+            if changed > self.hand_squares and now - self.still_since < self.hand_timeout:
+                return False
+        self.reference = current
+        self.pending = False
+        return True
+
+# Thread che applica il MotionGate ai frame acquisiti e richiede il riconoscimento solo quando serve.
+# Insegue anche la deriva della telecamera: le geometrie corrette e la perdita della scacchiera
+# vengono pubblicate su drift_events (stato, geometria, dimensioni del frame), letta dal thread di Tkinter
+class MotionWorker(threading.Thread):
+    def __init__(self, frames, on_settled, track_drift=True):
+        super().__init__(daemon=True)
+        self.frames = frames
+        self.on_settled = on_settled
+        self.track_drift = track_drift
+        self.gate = None
+        self.geometry = None
+        self.drift = None
+        self.pending_geometry = None #nuova calibrazione dal thread di Tk, applicata dal thread del movimento
+        self.geometry_lock = threading.Lock()
+        self.drift_events = queue.Queue()
+        self.refresh_reference = False
+        self.enabled = True
+        self.running = True
+
+    # Nuova calibrazione (chiamata dal thread di Tk): viene applicata all'inizio del prossimo ciclo
+    # del thread del movimento, così gate e tracker della deriva non cambiano mentre li sta usando
+    def set_geometry(self, geometry):
+        with self.geometry_lock:
+            self.pending_geometry = geometry
+
+    # Il riferimento per la deriva viene acquisito dal prossimo frame
+    def apply_geometry(self, geometry):
+        self.gate = MotionGate(geometry)
+        self.geometry = geometry
+        self.drift = None
+
+    # Aggiorna il riferimento della deriva al prossimo frame (es. dopo una mossa, con la scacchiera ferma)
+    def refresh_drift_reference(self):
+        self.refresh_reference = True
+
+    # Pubblica solo i cambiamenti: ogni correzione, la perdita della scacchiera e il ritorno al tracking
+    def update_drift(self, frame):
+        if self.drift is None:
+            self.drift = DriftTracker(self.geometry, frame)
+            return
+        if self.refresh_reference:
+            self.refresh_reference = False
+            if self.drift.status != LOST:
+                self.drift.set_reference(frame)
+        previous = self.drift.status
+        status = self.drift.update(frame)
+        if status == CORRECTED:
+            self.gate.update_geometry(self.drift.geometry)
+            self.drift_events.put((status, self.drift.geometry, frame.shape))
+        elif status != previous:
+            self.drift_events.put((status, None, frame.shape))
+
+    def invalidate(self):
+        if self.gate is not None:
+            self.gate.invalidate()
+
+    def run(self):
+        last_seq = 0
+        while self.running:
+            seq, frame = self.frames.wait_newer(last_seq, timeout=0.1)
+            if frame is None:
+                continue
+            last_seq = seq
+            with self.geometry_lock:
+                geometry, self.pending_geometry = self.pending_geometry, None
+            if geometry is not None:
+                self.apply_geometry(geometry)
+            if self.gate is None:
+                continue
+            try:
+                if self.track_drift:
+                    self.update_drift(frame)
+                if not self.enabled or self.drift is not None and self.drift.status == LOST:
+                    continue #con la scacchiera persa il riconoscimento darebbe posizioni sbagliate
+                if self.gate.update(frame):
+                    self.on_settled()
+            except Exception as e:
+                print(f"Errore nel rilevamento del movimento: {e}")
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,229 @@
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from detector import ChessPieceDetector
+from drift import CORRECTED, LOST, DriftTracker
+from engine_pool import EnginePool, STOCKFISH_PATH
+from fusion import SquareFusion
+from game_tracker import GameTracker, MOVED, REJECTED, RESYNC
+from metrics import LatencyHistogram
+from motion import MotionGate
+from pipeline import CaptureThread, LatestBuffer, RateCounter, crop_frame
+from recognize_position import board_geometry_from_detections
+from replay import load_calibration
+
+FUSION_FRAMES = 3
+CONTINUOUS_RESYNC_SECONDS = 2.0 #con --continuous una posizione non plausibile deve restare stabile per questo tempo (es. mano ferma sui pezzi)
+
+# Una scacchiera della sala: sorgente video con il suo thread di acquisizione, calibrazione, partita e statistiche.
+# resync_confirmations: aggiornamenti identici per accettare una posizione non plausibile (vedi GameTracker)
+class BoardSession:
+    def __init__(self, name, source, calibration=None, crop=True, resync_confirmations=FUSION_FRAMES):
+        self.name = name
+        self.cap = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+        self.frames = LatestBuffer()
+        self.capture = CaptureThread(self.cap, self.frames, crop=crop_frame if crop else None)
+        self.geometry = None
+        self.roi = None #regione della scacchiera elaborata dal detector, calcolata sul primo frame dopo l'orientamento
+        self.gate = None
+        self.drift = None #tracker della deriva, creato sul primo frame dopo l'orientamento
+        self.tracker = GameTracker(resync_confirmations=resync_confirmations)
+        self.fusion = SquareFusion(self.tracker.board.board_fen(), stable_frames=FUSION_FRAMES)
+        self.evaluation = None #ultima valutazione di Stockfish della posizione corrente
+        self.pending = 0 #frame ancora da riconoscere dopo che la scacchiera si è fermata
+        self.confirmation_requested = False
+        self.last_seq = 0
+        self.stats = RateCounter()
+        self.latency = LatencyHistogram()
+        self.moves = 0
+        if calibration:
+            self.set_geometry(load_calibration(calibration))
+
+    def set_geometry(self, geometry):
+        self.geometry = geometry
+        self.roi = None
+        self.drift = None
+        self.gate = MotionGate(geometry)
+        self.pending = FUSION_FRAMES
+        self.confirmation_requested = False
+
+    # Frame più recente non ancora elaborato, oppure None se la scacchiera non va riconosciuta in questo ciclo.
+    # Con il motion gate una scacchiera entra nel batch solo per FUSION_FRAMES frame dopo essersi fermata.
+    # Le correzioni della deriva aggiornano la geometria, una scacchiera persa resta ferma finché non torna inseguibile
+    def next_frame(self, continuous):
+        seq, frame = self.frames.latest()
+        if frame is None or seq == self.last_seq:
+            return None
+        self.stats.tick(dropped=max(0, seq - self.last_seq - 1))
+        self.last_seq = seq
+        if self.geometry is not None:
+            if self.drift is None:
+                self.drift = DriftTracker(self.geometry, frame)
+            elif self.drift.update(frame) == CORRECTED:
+                self.geometry = self.drift.geometry
+                self.roi = None
+                self.gate.update_geometry(self.geometry)
+            if self.drift.status == LOST:
+                return None
+        if self.geometry is not None and not continuous:
+            if self.gate.update(frame):
+                self.pending = FUSION_FRAMES
+                self.confirmation_requested = False
+            if self.pending == 0:
+                return None
+            self.pending -= 1
+        return frame
+
+    def region(self, frame):
+        if self.geometry is not None and self.roi is None:
+            self.roi = self.geometry.roi(frame.shape)
+        return self.roi
+
+    # Applica le detection del frame: orientamento (se manca la calibrazione), fusione e aggiornamento della partita
+    def process(self, frame, detections):
+        if self.geometry is None:
+            geometry = board_geometry_from_detections(detections, frame.shape)
+            if geometry is not None:
+                self.set_geometry(geometry)
+            return None
+        self.fusion.observe_detections(self.geometry, detections, frame.shape)
+        outcome = self.tracker.update(self.fusion.state())
+        if outcome == MOVED:
+            self.moves += len(self.tracker.last_moves)
+            self.drift.set_reference(frame) #i pezzi sono cambiati: nuovo riferimento per la deriva
+        elif outcome == RESYNC:
+            self.fusion.reset()
+        elif outcome == REJECTED and not self.confirmation_requested:
+            # l'assestamento produce un solo riconoscimento: una posizione da confermare ne richiede un secondo
+            # (senza motion gate pending non viene usato e i frame successivi arrivano comunque)
+            self.confirmation_requested = True
+            self.pending += FUSION_FRAMES
+        return outcome
+
+    def snapshot(self):
+        stats = {"board": self.name, "capture_fps": self.capture.stats.snapshot()["fps"], "recognition": self.stats.snapshot(), "moves": self.moves, "fen": self.tracker.board.fen(), "evaluation": self.evaluation}
+        if self.drift is not None:
+            stats["drift"] = self.drift.stats()
+        if self.latency.samples:
+            stats["latency_ms"] = self.latency.percentiles()
+        return stats
+
+# Riconoscimento di più scacchiere in un solo processo: ad ogni ciclo i frame nuovi di tutte le scacchiere
+# (ritagliati sulla regione della scacchiera, se già orientata) vengono riuniti in un'unica chiamata al detector,
+# poi ogni scacchiera aggiorna la propria partita.
+# Le valutazioni di Stockfish dopo ogni mossa vengono calcolate in background su un pool di motori condiviso
+class MultiBoardRunner(threading.Thread):
+    def __init__(self, detector, boards, max_fps=10.0, engine_pool=None, continuous=False, on_event=None):
+        super().__init__(daemon=True)
+        self.detector = detector
+        self.boards = boards
+        self.max_fps = max_fps
+        self.engine_pool = engine_pool
+        self.continuous = continuous
+        self.on_event = on_event
+        self.executor = ThreadPoolExecutor(max_workers=engine_pool.size) if engine_pool is not None else None
+        self.batches = RateCounter()
+        self.batch_sizes = LatencyHistogram() #usato come istogramma del numero di frame per batch
+        self.running = True
+
+    def run(self):
+        while self.running:
+            start = time.monotonic()
+            batch = []
+            for board in self.boards:
+                frame = board.next_frame(self.continuous)
+                if frame is not None:
+                    batch.append((board, frame))
+            if batch:
+                self.process_batch(batch, start)
+            delay = 1.0 / self.max_fps - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+    def process_batch(self, batch, start):
+        frames = [frame for _, frame in batch]
+        try:
+            detections = self.detector.detect_batch_roi(frames, [board.region(frame) for board, frame in batch])
+        except Exception as e:
+            print(f"Errore del detector, batch di {len(batch)} frame saltato: {e}", file=sys.stderr)
+            return
+        self.batches.tick()
+        self.batch_sizes.add(len(batch))
+        for (board, frame), frame_detections in zip(batch, detections):
+            try:
+                outcome = board.process(frame, frame_detections)
+            except Exception as e:
+                print(f"Errore durante il riconoscimento della scacchiera {board.name}: {e}", file=sys.stderr)
+                continue
+            board.latency.add((time.monotonic() - start) * 1000)
+            if outcome in (MOVED, RESYNC):
+                fen = board.tracker.board.fen()
+                if self.executor is not None:
+                    self.executor.submit(self.evaluate, board, fen)
+                if self.on_event is not None:
+                    self.on_event({"board": board.name, "time": round(time.time(), 3), "outcome": outcome, "moves": board.tracker.last_moves, "fen": fen})
+
+    def evaluate(self, board, fen):
+        try:
+            evaluation = self.engine_pool.evaluate(fen)
+        except Exception as e:
+            print(f"Errore di Stockfish sulla scacchiera {board.name}: {e}", file=sys.stderr)
+            return
+        if board.tracker.board.fen() == fen:
+            board.evaluation = evaluation
+
+    def snapshot(self):
+        stats = {"batches": self.batches.snapshot(), "boards": [board.snapshot() for board in self.boards]}
+        if self.batch_sizes.samples:
+            stats["batch_size"] = self.batch_sizes.percentiles()
+        return stats
+
+    def stop(self):
+        self.running = False
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+# Configurazione: lista JSON di scacchiere, es. [{"name": "tavolo1", "source": 0, "calibration": "tavolo1.json"}, ...]
+# "source" può essere l'indice di una webcam, un file video o un URL; "crop": false disattiva il ritaglio dei frame
+def load_boards(config_path, resync_confirmations=FUSION_FRAMES):
+    with open(config_path, encoding="utf-8") as file:
+        config = json.load(file)
+    return [BoardSession(entry.get("name", f"scacchiera{index + 1}"), entry["source"], entry.get("calibration"), entry.get("crop", True), resync_confirmations) for index, entry in enumerate(config)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Riconoscimento contemporaneo di più scacchiere (una sorgente video ciascuna) con inferenza a batch")
+    parser.add_argument("config", help="file JSON con l'elenco delle scacchiere")
+    parser.add_argument("--weights", default=None, help="pesi del modello (default: variabile DETECTION_MODEL o chesspiece-detection-model.pt)")
+    parser.add_argument("--fps", type=float, default=10.0, help="cicli di riconoscimento al secondo")
+    parser.add_argument("--continuous", action="store_true", help="riconosce ogni frame invece di attendere che la scacchiera sia ferma")
+    parser.add_argument("--engines", type=int, default=0, help="processi Stockfish per valutare le posizioni dopo ogni mossa (0 = nessuna valutazione)")
+    parser.add_argument("--stockfish", default=STOCKFISH_PATH)
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="secondi tra due stampe delle statistiche per scacchiera")
+    args = parser.parse_args()
+    # senza motion gate anche una mano sulla scacchiera viene riconosciuta ad ogni ciclo: la conferma
+    # di una posizione non plausibile va misurata in secondi e non in frame
+    resync_confirmations = max(FUSION_FRAMES, round(CONTINUOUS_RESYNC_SECONDS * args.fps)) if args.continuous else FUSION_FRAMES
+    boards = load_boards(args.config, resync_confirmations)
+    engine_pool = EnginePool(args.stockfish, size=args.engines) if args.engines > 0 else None
+    runner = MultiBoardRunner(ChessPieceDetector(args.weights), boards, max_fps=args.fps, engine_pool=engine_pool, continuous=args.continuous, on_event=lambda event: print(json.dumps(event), flush=True))
+    for board in boards:
+        board.capture.start()
+    runner.start()
+    try:
+        while True:
+            time.sleep(args.stats_interval)
+            print(json.dumps(runner.snapshot()), file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.stop()
+        for board in boards:
+            board.capture.stop()
+            board.capture.join(timeout=1)
+            board.cap.release()
+        if engine_pool is not None:
+            engine_pool.close()
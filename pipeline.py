@@ -0,0 +1,190 @@
+import queue
+import threading
+import time
+from collections import deque
+import numpy as np
+from metrics import METRICS
+
+# Contatore di frequenza su finestra mobile, usato per misurare gli FPS dei vari stadi
+class RateCounter:
+    def __init__(self, window=2.0):
+        self.window = window
+        self.count = 0
+        self.dropped = 0
+        self._timestamps = deque()
+        self._lock = threading.Lock()
+
+    def tick(self, dropped=0):
+        now = time.monotonic()
+        with self._lock:
+            self.count += 1
+            self.dropped += dropped
+            self._timestamps.append(now)
+            while self._timestamps and now - self._timestamps[0] > self.window:
+                self._timestamps.popleft()
+
+    def fps(self):
+        with self._lock:
+            if len(self._timestamps) < 2:
+                return 0.0
+            elapsed = self._timestamps[-1] - self._timestamps[0]
+            return (len(self._timestamps) - 1) / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self):
+        return {"count": self.count, "dropped": self.dropped, "fps": round(self.fps(), 1)}
+
+# Buffer limitato ad un solo elemento con politica "latest-wins":
+# il produttore sovrascrive sempre l'elemento precedente, i consumatori leggono solo il più recente
+class LatestBuffer:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._seq = 0
+        self.overwritten = 0 #elementi sovrascritti prima che qualcuno li leggesse
+        self._read_seq = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._seq > self._read_seq:
+                self.overwritten += 1
+            self._item = item
+            self._seq += 1
+            self._cond.notify_all()
+
+    # Restituisce (seq, elemento) senza attendere
+    def latest(self):
+        with self._cond:
+            self._read_seq = self._seq
+            return self._seq, self._item
+
+    # Attende un elemento più recente di last_seq, restituisce (seq, elemento) oppure (last_seq, None) allo scadere del timeout
+    def wait_newer(self, last_seq, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > last_seq, timeout=timeout):
+                return last_seq, None
+            self._read_seq = self._seq
+            return self._seq, self._item
+
+# Risultato pubblicato dal worker di inferenza
+class InferenceResult:
+    def __init__(self, seq, frame, result, detections, tag, timestamp, roi=None, error=None):
+        self.seq = seq
+        self.frame = frame
+        self.result = result #risultato di YOLO, relativo al ritaglio roi se presente
+        self.detections = detections #array Nx6 nelle coordinate del frame: classe, x, y, w, h (normalizzate), confidenza
+        self.roi = roi #regione della scacchiera elaborata dal detector (None = frame intero)
+        self.tag = tag #richiesta che ha generato la detection (None se solo overlay)
+        self.timestamp = timestamp
+        self.error = error #messaggio dell'eccezione del detector (None se la detection è riuscita)
+
+# Ritaglio del frame della webcam (25% dall'alto, 13% da destra), condiviso da overlay e riconoscimento
+def crop_frame(frame):
+    original_height = frame.shape[0]
+    original_width = frame.shape[1]
+    taglio_alto = int(original_height * 0.25)  # elimina 25% della foto dall'alto
+    taglio_destro = int(original_width * 0.13)  # 13% della foto da destra
+    return frame[taglio_alto:, :original_width - taglio_destro]
+
+# Thread di acquisizione: legge continuamente la webcam e riempie il buffer dei frame
+class CaptureThread(threading.Thread):
+    def __init__(self, cap, frames, crop=None):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.frames = frames
+        self.crop = crop
+        self.stats = RateCounter()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            with METRICS.span("capture"):
+                ret, frame = self.cap.read()
+            if not ret:
+                time.sleep(0.01)
+                continue
+            if self.crop is not None:
+                frame = self.crop(frame)
+            self.frames.put(frame)
+            self.stats.tick()
+
+    def stop(self):
+        self.running = False
+
+# Worker di inferenza: prende sempre il frame più recente, esegue il detector e pubblica il risultato.
+# In modalità continua (overlay attivo) lavora fino a max_fps, altrimenti solo su richiesta.
+# Dopo l'orientamento il detector elabora solo la regione della scacchiera (roi), per overlay e riconoscimento
+class InferenceWorker(threading.Thread):
+    def __init__(self, detector, frames, max_fps=10.0, continuous=True):
+        super().__init__(daemon=True)
+        self.detector = detector
+        self.frames = frames
+        self.results = LatestBuffer() #ultimo risultato, usato per l'overlay
+        self.detections = queue.Queue() #risultati richiesti esplicitamente, non vengono mai scartati
+        self.max_fps = max_fps
+        self.continuous = continuous
+        self.stats = RateCounter()
+        self.roi = None
+        self.running = True
+        self._requests = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    # Richiede una detection sul prossimo frame disponibile, tag viene riportato nel risultato.
+    # Con full_frame la detection ignora la regione della scacchiera (es. per ritrovare la scacchiera spostata)
+    def request_detection(self, tag, full_frame=False):
+        with self._lock:
+            self._requests.append((tag, full_frame))
+        self._wakeup.set()
+
+    # Regione (x0, y0, x1, y1) a cui limitare l'inferenza, None per tornare al frame intero
+    def set_roi(self, roi):
+        self.roi = roi
+
+    def _next_request(self):
+        with self._lock:
+            return self._requests.popleft() if self._requests else (None, False)
+
+    def run(self):
+        last_seq = 0
+        last_time = 0.0
+        while self.running:
+            tag, full_frame = self._next_request()
+            if tag is None:
+                if not self.continuous:
+                    self._wakeup.wait(timeout=0.1)
+                    self._wakeup.clear()
+                    continue
+                # limita la frequenza della detection continua: i frame arrivati nel frattempo vengono scartati
+                delay = 1.0 / self.max_fps - (time.monotonic() - last_time) if self.max_fps else 0
+                if delay > 0:
+                    self._wakeup.wait(timeout=delay)
+                    self._wakeup.clear()
+                    continue
+            seq, frame = self.frames.wait_newer(last_seq, timeout=0.1)
+            if frame is None:
+                if tag is not None:
+                    with self._lock:
+                        self._requests.appendleft((tag, full_frame))
+                continue
+            self.stats.tick(dropped=seq - last_seq - 1)
+            last_seq = seq
+            last_time = time.monotonic()
+            roi = None if full_frame else self.roi
+            # un errore del detector (frame anomalo, runtime ONNX/OpenVINO, regione fuori dal frame) non deve fermare
+            # il thread: la richiesta riceve un risultato fallito e il ciclo continua con il frame successivo
+            try:
+                with METRICS.span("inference"):
+                    result, detections = self.detector.predict_roi(frame, roi, save=False)
+            except Exception as e:
+                print(f"Errore del detector ({tag or 'overlay'}): {e}")
+                if tag is not None:
+                    self.detections.put(InferenceResult(seq, frame, None, np.zeros((0, 6), dtype=np.float32), tag, last_time, roi, error=str(e)))
+                continue
+            inference_result = InferenceResult(seq, frame, result, detections, tag, last_time, roi)
+            self.results.put(inference_result)
+            if tag is not None:
+                self.detections.put(inference_result)
+
+    def stop(self):
+        self.running = False
+        self._wakeup.set()
@@ -1,7 +1,12 @@
 from PIL import Image
 import cv2
 import numpy as np
-from find_FEN import dict_to_fen
+from board_state import SQUARE_NAMES, BoardState
+from metrics import METRICS
+
+ROOK_CLASSES = [1, 7]
+ROI_MARGIN = 0.75 #margine attorno alla scacchiera nella regione usata per l'inferenza, in caselle
+ROI_TOP_MARGIN = 2.0 #margine aggiuntivo verso l'alto, in caselle: i pezzi delle traverse lontane sporgono oltre il bordo
 
 # Calcola dimensioni immagine
 def get_image_dimensions(image_path):
@@ -9,48 +14,125 @@ def get_image_dimensions(image_path):
         width, height = img.size
     return width, height
 
+# Legge un file di etichette YOLO (classe, x, y, w, h normalizzate) e lo converte nell'array Nx6 delle detection
+def load_labels(file_path):
+    detections = np.loadtxt(file_path, dtype=np.float32, ndmin=2)
+    if detections.size == 0:
+        return np.zeros((0, 6), dtype=np.float32)
+    if detections.shape[1] == 5:
+        detections = np.hstack((detections, np.ones((len(detections), 1), dtype=np.float32)))
+    return detections[:, :6]
+
+# Punto di appoggio del pezzo sulla scacchiera (20% sopra il fondo della bounding box) in pixel
+def anchor_points(detections, frame_shape):
+    image_height, image_width = frame_shape[:2]
+    x_center = detections[:, 1]
+    y_center = detections[:, 2]
+    height = detections[:, 4]
+    y_bottom = y_center + height / 2
+    new_y = y_bottom - 0.2 * height
+    return np.stack((x_center * image_width, new_y * image_height), axis=1)
+
+# Trova i 4 angoli della scacchiera usando i pezzi di classe 1 e 7 (array di detection + dimensioni del frame)
+def find_corners_from_detections(detections, frame_shape):
+    rooks = detections[np.isin(detections[:, 0].astype(int), ROOK_CLASSES)]
+    points = anchor_points(rooks, frame_shape).astype(int)
+    return [(int(x), int(y)) for x, y in points]
+
 # Trova i 4 angoli della scacchiera usando i pezzi di classe 1 e 7
 def find_corners(image_path, file_path):
-    corners = []
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-    for line in lines:
-        parts = line.strip().split()
-        class_id = int(parts[0])
-        if class_id in [1, 7]:
-            x_center = float(parts[1])
-            y_center = float(parts[2])
-            height = float(parts[4])
-            y_bottom = y_center + height / 2
-            new_y = y_bottom - 0.2 * height
-            image_width, image_height = get_image_dimensions(image_path)
-            pixel_x = int(x_center * image_width)
-            pixel_y = int(new_y * image_height)
-            corners.append((pixel_x, pixel_y))
-    return corners
+    image_width, image_height = get_image_dimensions(image_path)
+    return find_corners_from_detections(load_labels(file_path), (image_height, image_width))
 
 # Orienta i 4 angoli nell'ordine corretto: a8, h8, h1, a1
-def orient_chessboard(img_start, txt_start):
-    corners = find_corners(img_start, txt_start)
+def order_corners(corners):
     a1 = max(corners, key=lambda p: p[1])
     h1 = max(corners, key=lambda p: p[0])
     a8 = min(corners, key=lambda p: p[0])
     h8 = min(corners, key=lambda p: p[1])
     return [a8, h8, h1, a1]
 
+# Calcola la matrice di omografia a partire dai 4 angoli
+def compute_homography(corners, output_size):
+    with METRICS.span("homography"):
+        pts_src = np.array(corners, dtype=np.float32)
+        w, h = output_size
+        pts_dst = np.array([
+            [0, 0],
+            [w - 1, 0],
+            [w - 1, h - 1],
+            [0, h - 1]
+        ], dtype=np.float32)
+        H, _ = cv2.findHomography(pts_src, pts_dst)
+    return H
+
 # Calcola matrice di omografia e rettifica
 def calcola_omografia(image_path, corners, output_size):
-    img = cv2.imread(image_path)
-    pts_src = np.array(corners, dtype=np.float32)
-    w, h = output_size
-    pts_dst = np.array([
-        [0, 0],
-        [w - 1, 0],
-        [w - 1, h - 1],
-        [0, h - 1]
-    ], dtype=np.float32)
-    H, _ = cv2.findHomography(pts_src, pts_dst)
-    return H
+    return compute_homography(corners, output_size)
+
+# Geometria della scacchiera: angoli e omografia vengono calcolati una sola volta (al riorientamento)
+# e riutilizzati per mappare tutte le bounding box di ogni ciclo con un'unica trasformazione
+class BoardGeometry:
+    def __init__(self, corners, output_size=(800, 800)):
+        self.corners = corners
+        self.output_size = output_size
+        self.square_size = output_size[0] / 8
+        self.H = compute_homography(corners, output_size)
+
+    # Trasforma in un'unica chiamata un array Nx2 di punti dal frame alla vista rettificata
+    def map_points(self, points):
+        if len(points) == 0:
+            return np.zeros((0, 2), dtype=np.float32)
+        src = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+        return cv2.perspectiveTransform(src, self.H).reshape(-1, 2)
+
+    # Converte i punti rettificati in (riga, colonna) della scacchiera, limitati all'intervallo 0-7
+    def points_to_cells(self, rectified_points):
+        cells = np.floor(rectified_points / self.square_size).astype(np.int64)
+        np.clip(cells, 0, 7, out=cells)
+        return cells[:, 1], cells[:, 0]
+
+    # Righe e colonne delle caselle occupate da ogni detection
+    def detections_to_cells(self, detections, frame_shape):
+        with METRICS.span("mapping"):
+            return self.points_to_cells(self.map_points(anchor_points(detections, frame_shape)))
+
+    # Regione del frame (x0, y0, x1, y1) che contiene scacchiera e pezzi: il bordo della vista rettificata,
+    # allargato di margin caselle, viene riportato nel frame con l'omografia inversa e poi esteso verso l'alto
+    def roi(self, frame_shape, margin=ROI_MARGIN, top_margin=ROI_TOP_MARGIN):
+        w, h = self.output_size
+        m = margin * self.square_size
+        outline = np.array([[-m, -m], [w + m, -m], [w + m, h + m], [-m, h + m]], dtype=np.float32).reshape(-1, 1, 2)
+        points = cv2.perspectiveTransform(outline, np.linalg.inv(self.H)).reshape(-1, 2)
+        x0, y0 = points.min(axis=0)
+        x1, y1 = points.max(axis=0)
+        y0 -= top_margin * (y1 - y0) / (8 + 2 * margin)
+        frame_height, frame_width = frame_shape[:2]
+        return (max(0, int(x0)), max(0, int(y0)), min(frame_width, int(np.ceil(x1))), min(frame_height, int(np.ceil(y1))))
+
+# Geometria della scacchiera dalle torri negli angoli, oppure None se le torri trovate non sono esattamente 4
+# o se gli angoli ordinati non formano un quadrilatero convesso (omografia degenere)
+def board_geometry_from_detections(detections, frame_shape):
+    corners = find_corners_from_detections(detections, frame_shape)
+    if len(corners) != 4:
+        return None
+    ordered = order_corners(corners)
+    if len(set(ordered)) != 4 or not cv2.isContourConvex(np.array(ordered, dtype=np.int32)):
+        return None
+    geometry = BoardGeometry(ordered)
+    if geometry.H is None or not np.isfinite(geometry.H).all():
+        return None
+    return geometry
+
+def orient_chessboard_from_detections(detections, frame_shape):
+    geometry = board_geometry_from_detections(detections, frame_shape)
+    if geometry is None:
+        raise ValueError("impossibile orientare la scacchiera: servono esattamente 4 torri, una per angolo")
+    return geometry
+
+def orient_chessboard(img_start, txt_start):
+    image_width, image_height = get_image_dimensions(img_start)
+    return orient_chessboard_from_detections(load_labels(txt_start), (image_height, image_width))
 
 # Converte coordinate trasformate in notazione algebrica (es: "e4")
 def pixel_to_square(x, y, square_size=100):
@@ -62,29 +144,15 @@ def pixel_to_square(x, y, square_size=100):
     rank = str(8 - row)        # row 0 (in alto) → '8', row 7 (in basso) → '1'
     return file + rank
 
+# Trova posizione di ogni pezzo in notazione scacchistica a partire dall'array delle detection
+def find_pieces_position_from_detections(detections, frame_shape, geometry):
+    rows, cols = geometry.detections_to_cells(detections, frame_shape)
+    return list(zip(detections[:, 0].astype(int).tolist(), SQUARE_NAMES[rows, cols].tolist()))
+
 # Trova posizione di ogni pezzo in notazione scacchistica
-def find_pieces_position(image_path, file_path, H):
-    positions = []
+def find_pieces_position(image_path, file_path, geometry):
     image_width, image_height = get_image_dimensions(image_path)
-    with open(file_path, 'r') as file:
-        for line in file:
-            parts = line.strip().split()
-            class_id = int(parts[0])
-            x_center = float(parts[1])
-            y_center = float(parts[2])
-            height = float(parts[4])
-            # Punto 20% sopra il fondo della bounding box
-            y_bottom = y_center + height / 2
-            new_y = y_bottom - 0.20 * height
-            pixel_x = x_center * image_width
-            pixel_y = new_y * image_height
-            # Trasforma con omografia
-            src_pt = np.array([[[pixel_x, pixel_y]]], dtype=np.float32)
-            dst_pt = cv2.perspectiveTransform(src_pt, H)[0][0]
-            # Converti a notazione scacchistica
-            square = pixel_to_square(dst_pt[0], dst_pt[1])
-            positions.append((class_id, square))
-    return positions
+    return find_pieces_position_from_detections(load_labels(file_path), (image_height, image_width), geometry)
 
 def create_position_dictionary(positions):
     chessboard_dict = {}
@@ -98,24 +166,25 @@ def create_position_dictionary(positions):
         chessboard_dict[square] = class_id
     return chessboard_dict
 
-def extract_FEN(corners, image_path, txt_path, turn, castling_options, halfmove_clock, fullmove_number, en_passant):
-    H = calcola_omografia(image_path, corners, output_size=(800, 800))
-    positions = find_pieces_position(image_path, txt_path, H)
-    chessboard_dict = create_position_dictionary(positions)
-    FEN = dict_to_fen(chessboard_dict, turn, castling_options, halfmove_clock, fullmove_number, en_passant)
-    return FEN
+# Posizione (BoardState) prodotta direttamente dalla mappatura delle detection sulle caselle
+def detections_to_state(geometry, detections, frame_shape):
+    rows, cols = geometry.detections_to_cells(detections, frame_shape)
+    return BoardState.from_cells(rows, cols, detections[:, 0].astype(np.uint8), detections[:, 5])
 
-def extract_FEN(corners, image_path, txt_path):
-    H = calcola_omografia(image_path, corners, output_size=(800, 800))
-    positions = find_pieces_position(image_path, txt_path, H)
-    chessboard_dict = create_position_dictionary(positions)
-    FEN = dict_to_fen(chessboard_dict)
-    return FEN
+# Calcola la FEN direttamente dalle detection in memoria (nessun accesso al disco)
+def detections_to_FEN(geometry, detections, frame_shape):
+    state = detections_to_state(geometry, detections, frame_shape)
+    with METRICS.span("fen"):
+        return state.board_fen()
+
+def extract_FEN(geometry, image_path, txt_path):
+    image_width, image_height = get_image_dimensions(image_path)
+    return detections_to_FEN(geometry, load_labels(txt_path), (image_height, image_width))
 
 if __name__ == "__main__":
-    corners = orient_chessboard("foto_scattate_telecamera/photo33.png", "runs/detect/predict/labels/photo33.txt")
+    geometry = orient_chessboard("foto_scattate_telecamera/photo33.png", "runs/detect/predict/labels/photo33.txt")
     numbers = ["33", "34", "35", "36"]
     for number in numbers:
         image_path = f"foto_scattate_telecamera/photo{number}.png"
         txt_path = f"runs/detect/predict/labels/photo{number}.txt"
-        print(extract_FEN(corners, image_path, txt_path, "white", "KQkq"))
\ No newline at end of file
+        print(extract_FEN(geometry, image_path, txt_path))
@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import sys
+import time
+import chess.pgn
+import cv2
+import numpy as np
+from archive import is_archive_session, read_archive
+from detector import ChessPieceDetector
+from fusion import SquareFusion
+from game_tracker import GameTracker, MOVED, REJECTED, RESYNC
+from motion import MotionGate
+from pipeline import crop_frame
+from recognize_position import BoardGeometry, board_geometry_from_detections
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+# Frame di un video o di una cartella di immagini (in ordine di nome): (indice, istante in secondi o None, frame)
+# Con stride > 1 vengono elaborati solo un frame ogni stride, quelli saltati non vengono decodificati
+def read_frames(source, stride=1):
+    if os.path.isdir(source):
+        names = sorted(name for name in os.listdir(source) if name.lower().endswith(IMAGE_EXTENSIONS))
+        for index, name in enumerate(names):
+            if index % stride == 0:
+                frame = cv2.imread(os.path.join(source, name))
+                if frame is not None:
+                    yield index, None, frame
+        return
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise ValueError(f"Impossibile aprire il video {source}")
+    index = 0
+    try:
+        while True:
+            if index % stride == 0:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                yield index, cap.get(cv2.CAP_PROP_POS_MSEC) / 1000, frame
+            elif not cap.grab():
+                break
+            index += 1
+    finally:
+        cap.release()
+
+# Frame di una sessione dell'archivio (già ritagliati): (indice, istante, frame, record dell'indice)
+def read_archived_frames(session, stride=1):
+    for index, (record, frame) in enumerate(read_archive(session)):
+        if index % stride == 0:
+            yield index, record["time"], frame, record
+
+# File di calibrazione: {"corners": [[x, y], ...]} con gli angoli a8, h8, h1, a1 in pixel del frame ritagliato
+def load_calibration(path):
+    with open(path, encoding="utf-8") as file:
+        data = json.load(file)
+    return BoardGeometry([tuple(corner) for corner in data["corners"]])
+
+def save_calibration(path, geometry):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"corners": [[int(x), int(y)] for x, y in geometry.corners]}, file)
+
+# Riconoscimento senza interfaccia: detection -> caselle -> FEN fusa -> mosse legali, un frame alla volta.
+# Con motion_gate, come nell'applicazione, dopo l'orientamento vengono riconosciuti solo fusion_frames frame
+# ogni volta che la scacchiera si ferma: una mano sopra la scacchiera non arriva alla fusione né al tracker
+class Replay:
+    def __init__(self, detector, geometry=None, fusion_frames=3, use_roi=True, motion_gate=True):
+        self.detector = detector
+        self.geometry = geometry
+        self.use_roi = use_roi
+        self.roi = None
+        self.fusion_frames = fusion_frames
+        self.motion_gate = motion_gate
+        self.gate = None
+        self.pending = fusion_frames #frame ancora da riconoscere dopo che la scacchiera si è fermata
+        self.confirmation_requested = False
+        # una posizione non plausibile deve essere confermata anche dal riconoscimento successivo (vedi main.py)
+        self.tracker = GameTracker(resync_confirmations=fusion_frames)
+        self.fusion = SquareFusion(self.tracker.board.board_fen(), stable_frames=fusion_frames)
+        self.frames = 0
+        self.timings = {"detection": 0.0, "tracking": 0.0}
+
+    # Senza calibrazione la scacchiera viene orientata dal primo frame in cui si vedono le 4 torri
+    def orient(self, detections, frame_shape):
+        self.geometry = board_geometry_from_detections(detections, frame_shape)
+        return self.geometry is not None
+
+    # Elabora un frame e restituisce l'esito del tracker (None se la scacchiera non è ancora orientata
+    # o se il frame non fa parte di un riconoscimento). Con detections già note (es. salvate nell'archivio)
+    # il detector non viene eseguito. Come nell'applicazione, una volta orientata la scacchiera il detector
+    # elabora solo la sua regione. timestamp: istante del frame in secondi, usato dal motion gate
+    def process(self, frame, detections=None, timestamp=None):
+        if self.motion_gate and self.geometry is not None and not self.gated(frame, timestamp):
+            return None
+        start = time.perf_counter()
+        if detections is None:
+            if self.roi is None and self.use_roi and self.geometry is not None:
+                self.roi = self.geometry.roi(frame.shape)
+            detections = self.detector.detect_roi(frame, self.roi)
+        detected = time.perf_counter()
+        self.frames += 1
+        self.timings["detection"] += detected - start
+        if self.geometry is None and not self.orient(detections, frame.shape):
+            return None
+        self.fusion.observe_detections(self.geometry, detections, frame.shape)
+        outcome = self.tracker.update(self.fusion.state())
+        if outcome == RESYNC:
+            self.fusion.reset()
+        elif outcome == REJECTED and self.motion_gate and not self.confirmation_requested:
+            # l'assestamento produce un solo riconoscimento: una posizione da confermare ne richiede un secondo
+            self.confirmation_requested = True
+            self.pending += self.fusion_frames
+        self.timings["tracking"] += time.perf_counter() - detected
+        return outcome
+
+    # True se il frame va riconosciuto: uno dei fusion_frames frame successivi all'assestamento della scacchiera
+    def gated(self, frame, timestamp):
+        if self.gate is None:
+            self.gate = MotionGate(self.geometry)
+        if self.gate.update(frame, timestamp):
+            self.pending = self.fusion_frames
+            self.confirmation_requested = False
+        if self.pending == 0:
+            return False
+        self.pending -= 1
+        return True
+
+    # Una partita PGN per ogni tratto tra due risincronizzazioni, con la posizione di partenza nell'intestazione FEN:
+    # le mosse riconosciute prima di una risincronizzazione restano nel file. I tratti senza mosse vengono
+    # saltati, tranne l'ultimo che riporta la posizione finale
+    def pgn(self, source):
+        segments = self.tracker.segments()
+        games = []
+        for number, (fen, moves) in enumerate(segments, start=1):
+            if not moves and number < len(segments):
+                continue
+            game = chess.pgn.Game()
+            game.setup(fen)
+            game.headers["Event"] = "Chess Assistant AI replay"
+            game.headers["Site"] = os.path.basename(source)
+            game.headers["Round"] = str(number)
+            node = game
+            for san in moves:
+                node = node.add_variation(node.board().parse_san(san))
+            games.append(str(game))
+        return "\n\n".join(games)
+
+def stats_report(replay, frames_read, seconds):
+    frames = max(1, replay.frames)
+    return {
+        "frames_read": frames_read,
+        "frames_processed": replay.frames,
+        "seconds": round(seconds, 2),
+        "fps": round(replay.frames / seconds, 2) if seconds > 0 else 0.0,
+        "detection_ms": round(replay.timings["detection"] / frames * 1000, 2),
+        "tracking_ms": round(replay.timings["tracking"] / frames * 1000, 2),
+    }
+
+def run(args):
+    geometry = load_calibration(args.calibration) if args.calibration else None
+    archived = is_archive_session(args.source)
+    if archived:
+        frames = read_archived_frames(args.source, args.stride)
+    else:
+        frames = ((index, timestamp, frame, None) for index, timestamp, frame in read_frames(args.source, args.stride))
+    detector = None if archived and args.archived_detections else ChessPieceDetector(args.weights)
+    # i frame dell'archivio sono già quelli dei riconoscimenti dell'applicazione: il motion gate serve solo per video e cartelle
+    replay = Replay(detector, geometry, fusion_frames=args.fusion_frames, use_roi=not args.full_frame, motion_gate=not archived and not args.no_motion_gate)
+    output = open(args.jsonl, "w", encoding="utf-8") if args.jsonl != "-" else sys.stdout
+    frames_read = 0
+    start = time.perf_counter()
+    try:
+        for index, timestamp, frame, record in frames:
+            frames_read += 1
+            detections = None
+            if record is not None:
+                # l'archivio contiene frame già ritagliati e gli angoli dell'ultimo orientamento
+                if replay.geometry is None and "corners" in record:
+                    replay.geometry = BoardGeometry([tuple(corner) for corner in record["corners"]])
+                if args.archived_detections:
+                    detections = np.array(record.get("detections", []), dtype=np.float32).reshape(-1, 6)
+            elif not args.no_crop:
+                frame = crop_frame(frame)
+            oriented = replay.geometry is not None
+            outcome = replay.process(frame, detections, timestamp)
+            if not oriented and replay.geometry is not None and args.save_calibration:
+                save_calibration(args.save_calibration, replay.geometry)
+            if outcome in (MOVED, RESYNC) or (outcome is not None and args.every_frame):
+                event = {"frame": index, "time": timestamp, "outcome": outcome, "moves": replay.tracker.last_moves, "fen": replay.tracker.board.fen()}
+                output.write(json.dumps(event) + "\n")
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    seconds = time.perf_counter() - start
+    if args.pgn:
+        with open(args.pgn, "w", encoding="utf-8") as file:
+            print(replay.pgn(args.source), file=file)
+    print(json.dumps(stats_report(replay, frames_read, seconds)), file=sys.stderr)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Riconoscimento della partita da un video registrato o da una cartella di frame, senza interfaccia né webcam")
+    parser.add_argument("source", help="file video, cartella di immagini (elaborate in ordine di nome) oppure sessione dell'archivio (archive/<data-ora>)")
+    parser.add_argument("--calibration", help="file JSON con gli angoli della scacchiera (default: orientamento dal primo frame con le 4 torri)")
+    parser.add_argument("--save-calibration", help="salva gli angoli trovati sul primo frame in questo file")
+    parser.add_argument("--jsonl", default="-", help="file di output con una riga JSON per ogni mossa (default: stdout)")
+    parser.add_argument("--pgn", help="file PGN con la partita ricostruita")
+    parser.add_argument("--weights", default=None, help="pesi del modello (default: variabile DETECTION_MODEL o chesspiece-detection-model.pt)")
+    parser.add_argument("--stride", type=int, default=1, help="elabora un frame ogni stride")
+    parser.add_argument("--fusion-frames", type=int, default=3, help="frame consecutivi su cui deve essere stabile una casella")
+    parser.add_argument("--every-frame", action="store_true", help="scrive una riga anche per i frame senza mosse")
+    parser.add_argument("--archived-detections", action="store_true", help="per le sessioni dell'archivio usa le detection salvate invece di eseguire il modello")
+    parser.add_argument("--no-crop", action="store_true", help="non applica il ritaglio dei frame usato dall'applicazione")
+    parser.add_argument("--no-motion-gate", action="store_true", help="riconosce ogni frame invece di attendere che la scacchiera sia ferma (es. cartelle di foto scattate a scacchiera ferma)")
+    parser.add_argument("--full-frame", action="store_true", help="esegue il detector sull'intero frame invece che sulla sola regione della scacchiera")
+    run(parser.parse_args())
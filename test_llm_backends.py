@@ -0,0 +1,68 @@
+import threading
+import time
+from llm_backends import MAX_TOOL_ROUNDS, FakeBackend, ask
+
+# Strumento di prova: registra le chiamate e risponde con il nome e gli argomenti ricevuti
+class RecordingTools:
+    def __init__(self, delays=None):
+        self.calls = []
+        self.events = []
+        self.delays = delays or {}
+        self._lock = threading.Lock()
+
+    def __call__(self, name, args):
+        time.sleep(self.delays.get(name, 0.0))
+        with self._lock:
+            self.calls.append(name)
+            self.events.append(("tool", name))
+        if name == "guasto":
+            raise RuntimeError("motore non disponibile")
+        if name == "sconosciuta":
+            return None
+        return f"{name}:{args.get('fen', '')}"
+
+def test_tokens_are_streamed_after_the_tool_results():
+    tools = RecordingTools()
+    backend = FakeBackend(reply="Il bianco sta meglio.", tool_calls=[("top_moves", {"fen": "startpos"})])
+    tokens = []
+    def on_token(token):
+        tokens.append(token)
+        tools.events.append(("token", token))
+    text = ask(backend, "Chi sta meglio?", tools, on_token)
+    assert "".join(tokens).strip() == text
+    assert text.startswith("Il bianco sta meglio.")
+    assert "top_moves:startpos" in text
+    assert tools.events[0] == ("tool", "top_moves")
+    assert all(kind == "token" for kind, _ in tools.events[1:])
+
+def test_answer_without_tools_makes_no_calls():
+    tools = RecordingTools()
+    assert ask(FakeBackend(reply="Posizione equilibrata."), "Come sto?", tools) == "Posizione equilibrata."
+    assert tools.calls == []
+
+def test_tool_rounds_are_limited():
+    tools = RecordingTools()
+    backend = FakeBackend(reply="Risposta finale.", tool_calls=[("evaluation", {})], tool_rounds=10)
+    text = ask(backend, "Valuta", tools, max_rounds=2)
+    assert tools.calls == ["evaluation", "evaluation"]
+    assert text.startswith("Risposta finale.")
+
+def test_default_tool_round_limit():
+    tools = RecordingTools()
+    ask(FakeBackend(tool_calls=[("evaluation", {})], tool_rounds=MAX_TOOL_ROUNDS + 5), "Valuta", tools)
+    assert len(tools.calls) == MAX_TOOL_ROUNDS
+
+def test_results_keep_the_order_of_the_calls():
+    # la prima chiamata termina per ultima: i risultati devono comunque seguire l'ordine richiesto dal modello
+    tools = RecordingTools(delays={"lenta": 0.2, "media": 0.1})
+    backend = FakeBackend(reply="Fatto.", tool_calls=[("lenta", {"fen": "1"}), ("media", {"fen": "2"}), ("veloce", {"fen": "3"})])
+    text = ask(backend, "Analizza", tools)
+    assert tools.calls == ["veloce", "media", "lenta"]
+    assert text.splitlines()[1:] == ["lenta:1", "media:2", "veloce:3"]
+
+def test_failing_and_unknown_tools_are_reported_to_the_model():
+    tools = RecordingTools()
+    backend = FakeBackend(reply="Fatto.", tool_calls=[("guasto", {}), ("sconosciuta", {})])
+    lines = ask(backend, "Analizza", tools).splitlines()
+    assert lines[1] == "Errore durante l'esecuzione di guasto: motore non disponibile"
+    assert lines[2] == "Funzione sconosciuta: sconosciuta"